@@ -0,0 +1,142 @@
+"""
+性能测试使用的数据，模拟滴答清单中比较长的笔记、标签很多的任务以及从Notion读取的属性。
+所有数据都是固定生成的，多次运行之间可以直接比较。
+"""
+from todo2notion.config import (
+    DATE,
+    MULTI_SELECT,
+    NUMBER,
+    RELATION,
+    RICH_TEXT,
+    SELECT,
+    STATUS,
+    TITLE,
+)
+
+NOTE_SECTION = """## 第{index}部分 项目进度
+本周需要完成 **重要的任务**，参考 [接口文档](https://developers.notion.com/reference/request-limits) 里的说明。
+调用 `getRelationId()` 之前先检查缓存，公式 $a^2 + b^2 = c^2$，~已经取消~ 的事项和 __*特别重要*__ 的事项分开记录。
+**先运行 `todo --full` 再同步**，*详见 [说明](https://developers.notion.com/reference/intro) 一节*，**[热力图](https://example.com/heatmap)**。
+
+- 整理缓存
+  - 检查索引是否过期
+    - 删除已经归档的页面
+  - 重新建立 *日期* 索引
+- 更新热力图
+1. 第一步：导出数据
+2. 第二步：核对 **标签**
+3. 第三步：同步到Notion
+
+> 引用的一段话，用来说明背景
+> 第二行引用
+
+```python
+def sync(tasks):
+    for task in tasks:
+        print(task["title"])
+```
+
+$$
+\\sum_{{i=1}}^{{n}} x_i = {index}
+$$
+
+| 项目 | 负责人 | 状态 |
+|---|---|---|
+| 同步 | 张三 | 完成 |
+| 上传 | 李四 | 进行中 |
+
+![截图{index}](https://example.com/images/{index}.png)
+---
+没有任何格式的普通文本，用来模拟笔记中最常见的段落内容，长度稍微长一些。
+"""
+
+# 大约200行的长笔记
+LONG_NOTE = "\n".join(NOTE_SECTION.format(index=i) for i in range(6))
+
+INLINE_LINES = [
+    line
+    for line in LONG_NOTE.split("\n")
+    if line and not line.startswith(("|", "```", "$$", "!", "---"))
+]
+
+TABLE = """| 项目 | 负责人 | 状态 | 截止时间 | 备注 |
+|---|---|---|---|---|
+""" + "\n".join(
+    f"| 任务{i} | 成员{i % 7} | {'完成' if i % 3 else '进行中'} | 2024-01-{i % 28 + 1:02d} | 第{i}行备注 |"
+    for i in range(40)
+)
+
+TASK_SCHEMA = {
+    "标题": TITLE,
+    "id": RICH_TEXT,
+    "开始时间": DATE,
+    "结束时间": DATE,
+    "最后修改时间": DATE,
+    "完成时间": DATE,
+    "进度": NUMBER,
+    "状态": STATUS,
+    "优先级": SELECT,
+    "标签": RELATION,
+    "清单": RELATION,
+    "Parent task": RELATION,
+    "笔记": RELATION,
+    "年": RELATION,
+    "月": RELATION,
+    "周": RELATION,
+    "日": RELATION,
+    "全部": RELATION,
+    "Assignee": "people",
+    "星期": SELECT,
+    "笔记最后修改时间": RICH_TEXT,
+    "关键词": MULTI_SELECT,
+    "公式": "formula",
+}
+
+# 标签很多的任务，值已经转换成get_properties需要的格式
+TASK = {
+    "标题": "整理本周的同步脚本并补充文档" * 3,
+    "id": "65a4f0e2b1c3d40001234567",
+    "开始时间": 1705334400,
+    "结束时间": 1705420800,
+    "最后修改时间": 1705380000,
+    "完成时间": 1705400000,
+    "进度": 0.6,
+    "状态": "Done",
+    "优先级": "高",
+    "标签": [f"{i:032x}" for i in range(30)],
+    "清单": ["0f1e2d3c4b5a69788796a5b4c3d2e1f0"],
+    "Assignee": [{"id": "5e6f7a8b-0000-4000-8000-000000000000", "object": "user"}],
+    "星期": "星期一",
+    "笔记最后修改时间": '{"a": 1705380000, "b": 1705390000}',
+    "关键词": [f"关键词{i}" for i in range(20)],
+}
+
+# 从Notion读取的页面属性
+NOTION_PROPERTIES = [
+    {"type": "title", "title": [{"type": "text", "plain_text": "整理本周的同步脚本"}]},
+    {"type": "rich_text", "rich_text": [{"type": "text", "plain_text": "65a4f0e2b1c3d40001234567"}]},
+    {"type": "rich_text", "rich_text": []},
+    {"type": "status", "status": {"name": "Done"}},
+    {"type": "select", "select": {"name": "高"}},
+    {"type": "date", "date": {"start": "2024-01-16T00:00:00.000+08:00", "end": None}},
+    {"type": "relation", "relation": [{"id": f"{i:032x}"} for i in range(30)]},
+    {"type": "files", "files": [{"type": "external", "external": {"url": "https://example.com/a.png"}}]},
+    {"type": "number", "number": 0.6},
+]
+
+EMOJI_TITLES = [
+    "📚 读书笔记",
+    "🏃‍♂️ 每天跑步五公里",
+    "工作安排",
+    "🇨🇳 国庆假期计划",
+    "✅ 已完成的事项",
+    "没有表情的很长的清单名称用来模拟普通情况",
+]
+
+# 滴答清单返回的时间，互不相同，用来测试没有命中缓存的情况
+DIDA_TIMES = [
+    f"2024-{month:02d}-{day:02d}T{hour:02d}:30:00.000+0000"
+    for month in range(1, 13)
+    for day in range(1, 29)
+    for hour in (0, 8, 16)
+]
@@ -0,0 +1,108 @@
+"""
+行内格式转换的性能测试：对比原来七次正则替换的实现和现在两次预编译正则扫描的实现。
+
+    python benchmarks/inline_formatting.py [-n 次数] [--lines 行数]
+
+测试数据是一段包含粗体、斜体、代码、链接、公式和删除线（包括粗体中的代码和链接）的长笔记，
+输出每种实现处理整段笔记的耗时以及加速比。
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from todo2notion.utils import get_text_object, process_inline_formatting  # noqa: E402
+
+LINES = [
+    "今天完成了 **重要的任务**，还有一些 *细节* 需要确认。",
+    "参考 [文档](https://developers.notion.com/reference/request-limits) 里的说明。",
+    "调用 `getRelationId()` 之前先检查缓存，公式 $a^2 + b^2 = c^2$。",
+    "~已经取消~ 的事项和 __*特别重要*__ 的事项分开记录。",
+    "没有任何格式的普通文本，用来模拟笔记中最常见的段落内容，长度稍微长一些。",
+]
+# 粗体、斜体中包含代码和链接，原来的实现会把代码和链接的标记原样保留在粗体文本中
+NESTED_LINES = [
+    "**use `foo` here**",
+    "*see [docs](https://developers.notion.com) now*",
+    "**[link](https://developers.notion.com)**",
+]
+
+
+def legacy_process_inline_formatting(text):
+    """原来的实现：每种格式一次正则扫描，每次都重新编译正则"""
+
+    def replace_part(parts, pattern, replace_function):
+        new_text_parts = []
+        for part in parts:
+            if isinstance(part, str):
+                prev_end = 0
+                for match in re.finditer(pattern, part):
+                    if prev_end != match.start():
+                        new_text_parts.append(part[prev_end:match.start()])
+                    new_text_parts.append(replace_function(match))
+                    prev_end = match.end()
+                new_text_parts.append(part[prev_end:])
+            else:
+                new_text_parts.append(part)
+        return new_text_parts
+
+    passes = [
+        (r"(__\*(.+?)\*__)|(\*\*_(.+?)_\*\*)", lambda m: get_text_object(m.group(2) or m.group(4), bold=True, italic=True)),
+        (r"(\*\*(.+?)\*\*)|(__(.+?)__)", lambda m: get_text_object(m.group(2) or m.group(4), bold=True)),
+        (r"(\*(.+?)\*)|(_(.+?)_)", lambda m: get_text_object(m.group(2) or m.group(4), italic=True)),
+        (r"\$(.+?)\$", lambda m: {"type": "equation", "equation": {"expression": m.group(1)}}),
+        (r"\~(.+?)\~", lambda m: get_text_object(m.group(1), strikethrough=True)),
+        (r"`(.+?)`", lambda m: get_text_object(m.group(1), code=True)),
+        (r"\[(.+?)\]\((.+?)\)", lambda m: get_text_object(m.group(1), url=m.group(2))),
+    ]
+    text_parts = [text]
+    for pattern, replace_function in passes:
+        text_parts = replace_part(text_parts, pattern, replace_function)
+    return [
+        ({"type": "text", "text": {"content": part}} if type(part) == str else part)
+        for part in text_parts
+        if part != ""
+    ]
+
+
+def run(function, lines):
+    for line in lines:
+        function(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="行内格式转换的性能测试")
+    parser.add_argument("-n", "--number", type=int, default=20, help="重复次数")
+    parser.add_argument("--lines", type=int, default=2000, help="笔记的行数")
+    args = parser.parse_args()
+    all_lines = LINES + NESTED_LINES
+    lines = [all_lines[i % len(all_lines)] for i in range(args.lines)]
+    # 不涉及优先级差异的文本，两种实现的结果应该一致
+    for line in LINES:
+        assert legacy_process_inline_formatting(line) == process_inline_formatting(line), line
+    # 嵌套的格式中每一段都带有外层的格式，不会留下"*"
+    for line in NESTED_LINES:
+        for x in process_inline_formatting(line):
+            assert "*" not in x["text"]["content"], line
+            assert x["annotations"]["bold"] or x["annotations"]["italic"], line
+    results = {}
+    for name, function in (
+        ("legacy (7 passes)", legacy_process_inline_formatting),
+        ("two passes", process_inline_formatting),
+    ):
+        seconds = min(
+            timeit.repeat(lambda: run(function, lines), number=1, repeat=args.number)
+        )
+        results[name] = seconds
+        print(
+            f"{name:<20} {seconds * 1000:8.2f} ms / {args.lines} lines   "
+            f"{args.lines / seconds:10.0f} lines/s"
+        )
+    print(f"speedup {results['legacy (7 passes)'] / results['two passes']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
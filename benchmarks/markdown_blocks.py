@@ -0,0 +1,75 @@
+"""
+Markdown转Notion块的性能测试：对比每次都用mistletoe解析和命中内容hash缓存的耗时。
+
+    python benchmarks/markdown_blocks.py [-n 次数] [--notes 笔记数量]
+
+测试数据是一组包含标题、列表、引用、代码、公式、表格和图片的笔记，
+缓存写在临时目录中，不影响.cache。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+
+from todo2notion.notion_renderer import convert, render_markdown  # noqa: E402
+
+NOTE = """# 周计划 {index}
+本周需要完成 **重要的任务**，参考 [文档](https://developers.notion.com/reference/request-limits)。
+
+## 待办
+- 整理 `getRelationId()` 的缓存
+  - 检查索引是否过期
+- 更新 *热力图*
+1. 第一步
+2. 第二步
+
+> 引用的一段话
+> 第二行
+
+```python
+print("hello")
+```
+
+$$
+a^2 + b^2 = c^2
+$$
+
+| 项目 | 状态 |
+|---|---|
+| 同步 | 完成 |
+
+![截图](https://example.com/{index}.png)
+---
+~已经取消~ 的事项。
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Markdown转Notion块的性能测试")
+    parser.add_argument("-n", "--number", type=int, default=5, help="重复次数")
+    parser.add_argument("--notes", type=int, default=200, help="笔记数量")
+    args = parser.parse_args()
+    notes = [NOTE.format(index=i) for i in range(args.notes)]
+    for note in notes:
+        assert render_markdown(note) == convert(note)
+    results = {}
+    for name, function in (("mistletoe", convert), ("memoized", render_markdown)):
+        seconds = min(
+            timeit.repeat(
+                lambda: [function(note) for note in notes], number=1, repeat=args.number
+            )
+        )
+        results[name] = seconds
+        print(
+            f"{name:<12} {seconds * 1000:8.2f} ms / {args.notes} notes   "
+            f"{args.notes / seconds:10.0f} notes/s"
+        )
+    print(f"speedup {results['mistletoe'] / results['memoized']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
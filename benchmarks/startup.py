@@ -0,0 +1,102 @@
+"""
+启动耗时测试：导入各个入口模块的时间、todo --help的时间，以及从启动到发出第一个Notion请求的时间。
+
+    python benchmarks/startup.py [-n 次数]
+
+每一项都在新的子进程中运行，取多次运行的最小值和中位数。
+第一个请求在发出之前就被拦截，不需要网络和真实的NOTION_TOKEN。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_CODE = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+# 拦截httpx发出的第一个请求，输出从进程启动到这个时刻的时间
+FIRST_REQUEST_CODE = """
+import os, sys, time
+start = time.perf_counter()
+import httpx
+
+def handle_request(self, request):
+    print(time.perf_counter() - start)
+    sys.stdout.flush()
+    os._exit(0)
+
+httpx.HTTPTransport.handle_request = handle_request
+sys.argv = ["todo"]
+from todo2notion import todo
+todo.main()
+"""
+
+HELP_CODE = """
+import sys, time
+start = time.perf_counter()
+sys.argv = ["todo", "--help"]
+from todo2notion import todo
+try:
+    todo.main()
+except SystemExit:
+    pass
+print(time.perf_counter() - start)
+"""
+
+
+def run(code, env):
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(result.stderr.strip() or result.stdout.strip())
+    return float(lines[-1])
+
+
+def measure(name, code, env, number):
+    values = sorted(run(code, env) for _ in range(number))
+    print(
+        f"{name:<34} min {values[0] * 1000:8.1f} ms   "
+        f"median {statistics.median(values) * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时测试")
+    parser.add_argument("-n", "--number", type=int, default=5, help="每一项运行的次数")
+    args = parser.parse_args()
+    env = dict(os.environ)
+    env.setdefault("NOTION_TOKEN", "secret_benchmark")
+    env.setdefault("NOTION_PAGE", "https://www.notion.so/" + "0" * 32)
+    # 使用空的缓存目录，测试的是没有缓存时的冷启动
+    env["CACHE_DIR"] = tempfile.mkdtemp()
+    env["PYTHONPATH"] = ROOT
+    for module in (
+        "todo2notion",
+        "todo2notion.utils",
+        "todo2notion.todo",
+        "todo2notion.update_heatmap",
+    ):
+        measure(f"import {module}", IMPORT_CODE.format(module=module), env, args.number)
+    measure("todo --help", HELP_CODE, env, args.number)
+    measure("time to first request", FIRST_REQUEST_CODE, env, args.number)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    main()
+    print(f"total {time.perf_counter() - start:.1f} s")
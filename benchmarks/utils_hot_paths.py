@@ -0,0 +1,179 @@
+"""
+utils中每个任务都会调用的函数的性能测试，输出每秒执行次数和内存分配，并和保存的基线比较。
+
+    python benchmarks/utils_hot_paths.py            # 运行并和baseline.json比较
+    python benchmarks/utils_hot_paths.py --save     # 运行并保存为新的基线
+    python benchmarks/utils_hot_paths.py --check    # 有变慢超过阈值的项目时返回1
+    python benchmarks/utils_hot_paths.py -k parse   # 只运行名称包含parse的项目
+
+每个项目先用timeit自动确定循环次数，重复多次取最快的一次。
+内存分配用tracemalloc统计单次调用的峰值内存和调用结束之后仍然存活的内存块数量。
+每秒执行次数受机器负载影响，内存块数量每次运行都一样，比较时两者都会检查。
+基线和运行环境有关，换机器或者Python版本之后需要重新保存。
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Markdown转换的磁盘缓存写在临时目录中，不影响.cache
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+
+import fixtures  # noqa: E402
+from todo2notion import dates, utils  # noqa: E402
+from todo2notion.notion_renderer import convert  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def parse_date_cold():
+    dates.parse.cache_clear()
+    return [utils.parse_date(x) for x in fixtures.DIDA_TIMES[:20]]
+
+
+def parse_date_warm():
+    return [utils.parse_date(x) for x in fixtures.DIDA_TIMES[:20]]
+
+
+# 名称、说明（一次调用处理的内容）、函数
+BENCHMARKS = [
+    ("parse_md", "长笔记，命中缓存", lambda: utils.parse_md(fixtures.LONG_NOTE)),
+    ("parse_md (cold)", "长笔记，不使用缓存", lambda: convert(fixtures.LONG_NOTE.strip())),
+    (
+        "process_inline_formatting",
+        f"{len(fixtures.INLINE_LINES)}行",
+        lambda: [utils.process_inline_formatting(x) for x in fixtures.INLINE_LINES],
+    ),
+    (
+        "convert_markdown_table_to_latex",
+        "40行5列的表格",
+        lambda: utils.convert_markdown_table_to_latex(fixtures.TABLE),
+    ),
+    (
+        "get_properties",
+        "一个任务",
+        lambda: utils.get_properties(fixtures.TASK, fixtures.TASK_SCHEMA),
+    ),
+    (
+        "get_property_value",
+        f"{len(fixtures.NOTION_PROPERTIES)}个属性",
+        lambda: [utils.get_property_value(x) for x in fixtures.NOTION_PROPERTIES],
+    ),
+    (
+        "split_emoji_from_string",
+        f"{len(fixtures.EMOJI_TITLES)}个标题",
+        lambda: [utils.split_emoji_from_string(x) for x in fixtures.EMOJI_TITLES],
+    ),
+    ("parse_date (cold)", "20个时间，不使用缓存", parse_date_cold),
+    ("parse_date", "20个时间，命中缓存", parse_date_warm),
+]
+
+
+def measure_speed(function, repeat):
+    """每秒执行次数，取多次重复中最快的一次"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat=repeat, number=number))
+
+
+def measure_memory(function):
+    """单次调用的峰值内存（KiB）以及调用结束之后结果占用的内存块数量"""
+    function()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1] - start
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    blocks = sum(
+        max(0, x.count_diff)
+        for x in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    )
+    del result
+    return peak / 1024, blocks
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(results):
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"基线已保存到 {BASELINE_PATH}")
+
+
+def format_change(value, base):
+    if not base:
+        return ""
+    return f"{(value / base - 1) * 100:+.0f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="utils热点函数的性能测试")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="重复次数")
+    parser.add_argument("-k", "--keyword", help="只运行名称包含这个关键字的项目")
+    parser.add_argument("--save", action="store_true", help="保存结果作为新的基线")
+    parser.add_argument("--check", action="store_true", help="有项目变慢超过阈值时返回1")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.3,
+        help="每秒执行次数下降或者内存块数量增加多少算作变慢，默认0.3",
+    )
+    args = parser.parse_args()
+    baseline = load_baseline()
+    results = {}
+    regressions = []
+    print(
+        f"{'name':<34}{'ops/s':>12}{'baseline':>12}{'change':>9}"
+        f"{'peak KiB':>11}{'blocks':>9}  per op"
+    )
+    for name, description, function in BENCHMARKS:
+        if args.keyword and args.keyword not in name:
+            continue
+        ops = measure_speed(function, args.repeat)
+        peak, blocks = measure_memory(function)
+        results[name] = {"ops": round(ops, 1), "peak_kib": round(peak, 1), "blocks": blocks}
+        base = baseline.get(name, {}).get("ops")
+        base_blocks = baseline.get(name, {}).get("blocks")
+        if base and ops < base * (1 - args.threshold):
+            regressions.append(name)
+        elif base_blocks and blocks > base_blocks * (1 + args.threshold):
+            regressions.append(f"{name}（内存块）")
+        print(
+            f"{name:<34}{ops:>12.1f}{base or '-':>12}{format_change(ops, base):>9}"
+            f"{peak:>11.1f}{blocks:>9}  {description}"
+        )
+    if args.save:
+        save_baseline({**baseline, **results})
+    if regressions:
+        print(f"比基线差{args.threshold:.0%}以上: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
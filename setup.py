@@ -8,6 +8,7 @@ setup(
         "pendulum",
         "retrying",
         "notion-client",
+        "httpx",
         "github-heatmap",
         "python-dotenv",
         "emoji",
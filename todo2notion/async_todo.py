@@ -0,0 +1,616 @@
+"""
+基于asyncio的同步实现，Notion使用AsyncClient，滴答清单和附件使用httpx.AsyncClient。
+属性的生成、Markdown的转换以及本地状态都和同步版本共用。
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+
+import httpx
+import pendulum
+from notion_client import APIErrorCode, APIResponseError, AsyncClient
+
+from todo2notion import block_diff, todo, transport, utils
+from todo2notion.config import ATTACHMENT_WORKERS
+from todo2notion.notion_helper import TAG_ICON_URL, TARGET_ICON_URL
+from todo2notion.rate_limit import AsyncRateLimitedTransport
+from todo2notion.upload import NotionFileUploader
+
+DIDA_API_URL = "https://api.dida365.com"
+
+
+class AsyncTodo:
+    def __init__(self, concurrency=10):
+        self.notion_helper = todo.notion_helper
+        self.sync_state = todo.sync_state
+        # Notion的请求和同步版本共用同一个限流器
+        self.client = AsyncClient(
+            auth=os.getenv("NOTION_TOKEN"),
+            log_level=logging.ERROR,
+            timeout_ms=int(transport.TIMEOUT * 1000),
+            client=httpx.AsyncClient(transport=AsyncRateLimitedTransport()),
+        )
+        # notion_client用timeout_ms覆盖了httpx client的超时，这里重新设置连接超时
+        self.client.client.timeout = transport.get_timeout()
+        self.session = httpx.AsyncClient(
+            headers=todo.headers,
+            timeout=transport.get_timeout(),
+            transport=transport.create_async_transport(),
+        )
+        self.uploader = NotionFileUploader()
+        self.upload_session = httpx.AsyncClient(
+            timeout=transport.get_timeout(), transport=AsyncRateLimitedTransport()
+        )
+        # 限制同时等待中的请求数量
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.attachment_semaphore = asyncio.Semaphore(ATTACHMENT_WORKERS)
+        self.relation_tasks = {}
+
+    async def close(self):
+        await self.client.aclose()
+        await self.session.aclose()
+        await self.upload_session.aclose()
+
+    async def call(self, function, **kwargs):
+        """调用Notion接口，限流和重试由transport处理"""
+        async with self.semaphore:
+            return await function(**kwargs)
+
+    async def write_page(self, function, database_id, properties, **kwargs):
+        """
+        创建或者更新页面，和NotionHelper.create_page、update_page一样，
+        database结构发生变化时刷新缓存并移除已经不存在的属性之后重试。
+        """
+        try:
+            return await self.call(function, properties=properties, **kwargs)
+        except APIResponseError as e:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(
+                None, self.notion_helper.is_schema_error, e, database_id, properties
+            ):
+                raise
+            properties = await loop.run_in_executor(
+                None, self.notion_helper.remove_unknown_properties, database_id, properties
+            )
+            return await self.call(function, properties=properties, **kwargs)
+
+    async def login(self, username, password):
+        r = await self.session.post(
+            f"{DIDA_API_URL}/api/v2/user/signon?wc=true&remember=true",
+            json={"username": username, "password": password},
+        )
+        if r.status_code == 200:
+            print("登录成功")
+            return True
+        print(f"登录失败，状态码: {r.status_code}")
+        return False
+
+    async def get_relation_id(self, name, id, icon, properties=None):
+        """和NotionHelper共用缓存，同一个页面同时只查询和创建一次"""
+        page_id = self.notion_helper.get_cached_relation_id(name, id)
+        if page_id:
+            return page_id
+        key = f"{id}{name}"
+        task = self.relation_tasks.get(key)
+        if task is None:
+            task = self.relation_tasks[key] = asyncio.ensure_future(
+                self._get_relation_id(name, id, icon, properties)
+            )
+        try:
+            return await task
+        except Exception:
+            # 失败的结果不保留，之后用到时重新查询
+            if self.relation_tasks.get(key) is task:
+                del self.relation_tasks[key]
+            raise
+
+    async def _get_relation_id(self, name, id, icon, properties):
+        response = {"results": []}
+        # 已经建立索引的database中不存在的页面直接创建
+        if not self.notion_helper.is_indexed(id):
+            filter = {"property": "标题", "title": {"equals": name}}
+            response = await self.call(
+                self.client.databases.query, database_id=id, filter=filter
+            )
+        if len(response.get("results")) == 0:
+            properties = dict(properties or {})
+            properties["标题"] = utils.get_title(name)
+            page = await self.call(
+                self.client.pages.create,
+                parent={"database_id": id, "type": "database_id"},
+                properties=properties,
+                icon=utils.get_icon(icon),
+            )
+            page_id = page.get("id")
+        else:
+            page_id = response.get("results")[0].get("id")
+        self.notion_helper.set_cached_relation_id(name, id, page_id)
+        return page_id
+
+    async def prefetch_relations(self, items):
+        """并发获取所有任务需要的标签和日期relation，之后生成属性时直接读取缓存"""
+        args = {}
+
+        def collect(items):
+            for item in items:
+                for tag in item.get("tags") or []:
+                    args[(tag, self.notion_helper.tag_database_id)] = (
+                        tag,
+                        self.notion_helper.tag_database_id,
+                        TAG_ICON_URL,
+                    )
+                date = todo.get_task_date(item)
+                if date:
+                    for value in self.notion_helper.get_date_relation_args(date).values():
+                        args[(value[0], value[1])] = value
+                collect(item.get("items") or [])
+
+        args[("全部", self.notion_helper.all_database_id)] = (
+            "全部",
+            self.notion_helper.all_database_id,
+            TARGET_ICON_URL,
+        )
+        collect(items)
+        await asyncio.gather(*[self.get_relation_id(*x) for x in args.values()])
+
+    async def get_projects(self, project_dict):
+        """获取所有清单"""
+        r = await self.session.get(f"{DIDA_API_URL}/api/v2/projects")
+        if not r.is_success:
+            print(f" Get projects failed ${r.text}")
+            return
+        items = [x for x in r.json() if todo.is_project_modified(x, project_dict)]
+
+        async def sync_project(item):
+            id = item.get("id")
+            properties, icon = todo.build_project(item)
+            database_id = self.notion_helper.project_database_id
+            if id in project_dict:
+                result = await self.write_page(
+                    self.client.pages.update,
+                    database_id,
+                    properties,
+                    page_id=project_dict.get(id).get("id"),
+                    icon=icon,
+                )
+            else:
+                result = await self.write_page(
+                    self.client.pages.create,
+                    database_id,
+                    properties,
+                    parent={"database_id": database_id, "type": "database_id"},
+                    icon=icon,
+                )
+            project_dict[id] = result
+            todo.save_page("project", result)
+
+        await asyncio.gather(*[sync_project(x) for x in items])
+
+    async def get_all_completed(self, full=False):
+        """获取完成的任务，有水位时只获取上次同步之后新完成的任务"""
+        start, full = todo.get_completed_start(full)
+        date = pendulum.now()
+        result = []
+        complete = True
+        while True:
+            to = date.format("YYYY-MM-DD HH:mm:ss")
+            r = await self.session.get(
+                f"{DIDA_API_URL}/api/v2/project/all/completedInAll/",
+                params={"from": start, "to": to, "limit": 100},
+            )
+            if not r.is_success:
+                print(f"获取任务失败 {r.text}")
+                complete = False
+                break
+            l = r.json()
+            if l:
+                result.extend(l)
+                date = pendulum.parse(l[-1].get("completedTime"))
+            if len(l) < 100:
+                break
+        result = todo.remove_duplicates(result)
+        return result, todo.get_completed_meta(result, full, complete)
+
+    async def batch_check(self, check_point):
+        r = await self.session.get(f"{DIDA_API_URL}/api/v2/batch/check/{check_point}")
+        if r.is_success and r.json().get("syncTaskBean") is not None:
+            return r.json()
+        print(f"获取任务失败 {r.text}")
+        return None
+
+    async def get_all_task(self):
+        """获取未完成的任务，有checkPoint时只获取上次同步之后的增量数据"""
+        check_point = self.sync_state.get_meta("check_point", "0")
+        result = await self.batch_check(check_point)
+        if result is None and check_point != "0":
+            print(f"checkPoint {check_point} 已失效，重新获取全部任务")
+            check_point = "0"
+            result = await self.batch_check(check_point)
+        return todo.parse_batch_check(result, check_point)
+
+    async def get_task(self, full=False):
+        (results, meta), (tasks, deleted_ids, check_point) = await asyncio.gather(
+            self.get_all_completed(full), self.get_all_task()
+        )
+        # 上次同步之后完成的任务可能同时出现在两个接口中，保留已完成的记录
+        results = todo.remove_duplicates(results + tasks)
+        meta["check_point"] = check_point
+        return results, deleted_ids, meta
+
+    async def download_file(self, url, file_path, max_retries=3):
+        """流式下载，中断时从已经下载的位置继续，返回文件的sha256"""
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.part"
+        for i in range(max_retries):
+            headers = {}
+            if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+                headers["Range"] = f"bytes={os.path.getsize(tmp_path)}-"
+            try:
+                async with self.session.stream("GET", url, headers=headers) as r:
+                    if r.status_code not in (200, 206):
+                        print(f"文件下载失败，状态码: {r.status_code}")
+                        if "Range" not in headers:
+                            return None
+                        os.remove(tmp_path)
+                        continue
+                    offset = utils.get_range_offset(tmp_path, r.status_code, r.headers)
+                    if offset is None:
+                        os.remove(tmp_path)
+                        continue
+                    sha256 = hashlib.sha256()
+                    if offset:
+                        utils.update_file_hash(sha256, tmp_path)
+                    with open(tmp_path, "ab" if offset else "wb") as f:
+                        async for chunk in r.aiter_bytes(todo.DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            sha256.update(chunk)
+            except httpx.TransportError as e:
+                print(f"文件下载中断，重试 {i + 1}/{max_retries}: {e}")
+                await asyncio.sleep(2**i)
+                continue
+            os.replace(tmp_path, file_path)
+            return sha256.hexdigest()
+        return None
+
+    async def upload_file(self, file_path):
+        """上传文件到Notion，返回file_upload的id"""
+        if os.path.getsize(file_path) > self.uploader.MAX_SINGLE_PART_UPLOAD_SIZE:
+            # 大文件使用多部分上传
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.uploader.upload_file, file_path, None
+            )
+        file_name = os.path.basename(file_path)
+        content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        async with self.semaphore:
+            r = await self.upload_session.post(
+                f"{self.uploader.base_url}/file_uploads",
+                headers=self.uploader.headers,
+                json={"mode": "single_part", "filename": file_name, "content_type": content_type},
+            )
+            if not r.is_success:
+                print(f"创建文件上传对象时出错: {r.text}")
+                return None
+            file_upload_id = r.json().get("id")
+            headers = {
+                k: v for k, v in self.uploader.headers.items() if k != "Content-Type"
+            }
+            with open(file_path, "rb") as f:
+                r = await self.upload_session.post(
+                    f"{self.uploader.base_url}/file_uploads/{file_upload_id}/send",
+                    headers=headers,
+                    files={"file": (file_name, f, content_type)},
+                )
+            if not r.is_success:
+                print(f"单部分上传内容时出错: {r.text}")
+                return None
+        return file_upload_id
+
+    async def is_file_upload_reusable(self, file_upload_id):
+        async with self.semaphore:
+            r = await self.upload_session.get(
+                f"{self.uploader.base_url}/file_uploads/{file_upload_id}",
+                headers=self.uploader.headers,
+            )
+        return r.is_success and self.uploader.is_file_upload_reusable(r.json())
+
+    async def upload_image(self, blocks, project_id, id):
+        """并发下载和上传所有的图片，失败的图片块会被移除"""
+
+        async def transfer(block):
+            url = block.get("image").get("external").get("url")
+            dir, file_name = url.split("/")[:2]
+            download_url = f"{DIDA_API_URL}/api/v1/attachment/{project_id}/{id}/{dir}?action=download"
+            file_path = os.path.join("images", dir, file_name)
+            file_hash = todo.get_cached_attachment(url, file_path)
+            if file_hash is None:
+                file_hash = await self.download_file(download_url, file_path)
+                if file_hash is None:
+                    return None
+            file_upload_id = None
+            for x in self.sync_state.find("attachment", file_hash):
+                if await self.is_file_upload_reusable(x):
+                    file_upload_id = x
+                    break
+            if file_upload_id is None:
+                file_upload_id = await self.upload_file(file_path)
+            if file_upload_id:
+                self.sync_state.save(
+                    "attachment", url, file_upload_id, fingerprint=file_hash
+                )
+            return file_upload_id
+
+        async def limited_transfer(block):
+            async with self.attachment_semaphore:
+                try:
+                    return await transfer(block)
+                except Exception as e:
+                    print(f"上传图片失败: {e}")
+                    return None
+
+        images = todo.collect_image_blocks(blocks)
+        results = await asyncio.gather(*[limited_transfer(x[1]) for x in images])
+        todo.replace_image_blocks(images, results)
+        return blocks
+
+    async def get_block_children(self, id):
+        results = []
+        start_cursor = None
+        while True:
+            kwargs = {"start_cursor": start_cursor} if start_cursor else {}
+            response = await self.call(
+                self.client.blocks.children.list, block_id=id, **kwargs
+            )
+            results.extend(response.get("results"))
+            start_cursor = response.get("next_cursor")
+            if not response.get("has_more"):
+                return results
+
+    async def get_block_tree(self, id):
+        results = await self.get_block_children(id)
+        children = await asyncio.gather(
+            *[
+                self.get_block_tree(x.get("id")) if x.get("has_children") else asyncio.sleep(0, [])
+                for x in results
+            ]
+        )
+        for block, value in zip(results, children):
+            block["children"] = value
+        return results
+
+    async def append_deferred_blocks(self, ids, chunk):
+        for id, (block, extra_children, nested) in zip(ids, chunk):
+            if nested:
+                children = await self.get_block_children(id)
+                for index, grandchildren in nested.items():
+                    await self.append_block_tree(children[index].get("id"), grandchildren)
+            if extra_children:
+                await self.append_block_tree(id, extra_children)
+
+    async def append_packed_blocks(self, block_id, chunks, after=None):
+        """和NotionHelper.append_packed_blocks一样，只跳过Notion不接受的块"""
+        for chunk in chunks:
+            kwargs = {"after": after} if after else {}
+            try:
+                response = await self.call(
+                    self.client.blocks.children.append,
+                    block_id=block_id,
+                    children=[x[0] for x in chunk],
+                    **kwargs,
+                )
+            except APIResponseError as e:
+                if e.code != APIErrorCode.ValidationError:
+                    raise
+                if len(chunk) > 1:
+                    after = await self.append_packed_blocks(
+                        block_id, [[x] for x in chunk], after
+                    )
+                else:
+                    print(f"跳过Notion不接受的块: {e}")
+                continue
+            ids = [x.get("id") for x in response.get("results")]
+            await self.append_deferred_blocks(ids, chunk)
+            if after:
+                after = ids[-1]
+        return after
+
+    async def append_block_tree(self, block_id, blocks, after=None):
+        await self.append_packed_blocks(
+            block_id, self.notion_helper.pack_blocks(blocks), after
+        )
+
+    async def get_blocks(self, item, notes):
+        blocks = []
+        if item.get("content"):
+            blocks = utils.parse_md(item.get("content"))
+        for note in notes:
+            blocks.extend(await self.get_block_children(note.get("id")))
+        return blocks
+
+    async def create_task_page(self, item, parent, properties, icon, notes, fingerprint):
+        """创建任务页面，第一批块随页面一起创建，剩下的块打包追加"""
+        chunks = []
+        try:
+            blocks = await self.get_blocks(item, notes)
+            await self.upload_image(blocks, item.get("projectId"), item.get("id"))
+            chunks = self.notion_helper.pack_blocks(blocks)
+        except Exception as e:
+            print(f"生成块时发生异常: {e}")
+            fingerprint = None
+        first_chunk = chunks.pop(0) if chunks else []
+        kwargs = {"children": [x[0] for x in first_chunk]} if first_chunk else {}
+        database_id = parent.get("database_id")
+        try:
+            result = await self.write_page(
+                self.client.pages.create,
+                database_id,
+                properties,
+                parent=parent,
+                icon=icon,
+                **kwargs,
+            )
+        except APIResponseError as e:
+            if not first_chunk or e.code != APIErrorCode.ValidationError:
+                raise
+            # 第一批块中有Notion不接受的块，先创建空页面，再逐批追加并跳过出错的块
+            print(f"追加块时发生异常: {e}")
+            result = await self.write_page(
+                self.client.pages.create, database_id, properties, parent=parent, icon=icon
+            )
+            chunks.insert(0, first_chunk)
+            first_chunk = []
+        try:
+            if any(x[1] or x[2] for x in first_chunk):
+                ids = [x.get("id") for x in await self.get_block_children(result.get("id"))]
+                await self.append_deferred_blocks(ids, first_chunk)
+            await self.append_packed_blocks(result.get("id"), chunks)
+        except Exception as e:
+            print(f"追加块时发生异常: {e}")
+            fingerprint = None
+        return result, fingerprint
+
+    async def update_page_content(self, page_id, blocks, project_id, id):
+        """对比页面中已有的块，只修改发生变化的块"""
+        old_blocks = await self.get_block_tree(page_id)
+        for operation in block_diff.diff_blocks(blocks, old_blocks, page_id):
+            if operation.get("op") == "delete":
+                await self.call(
+                    self.client.blocks.delete, block_id=operation.get("block_id")
+                )
+            elif operation.get("op") == "update":
+                await self.call(
+                    self.client.blocks.update,
+                    block_id=operation.get("block_id"),
+                    **operation.get("block"),
+                )
+            elif operation.get("op") == "insert":
+                children = await self.upload_image(operation.get("blocks"), project_id, id)
+                await self.append_block_tree(
+                    operation.get("parent_id"), children, operation.get("after")
+                )
+
+    async def add_task_to_notion(self, items, project_dict, todo_dict, page_id=None):
+        # 比较笔记修改时间时可能需要同步请求Notion，放到线程池中执行
+        loop = asyncio.get_running_loop()
+        modified = await asyncio.gather(
+            *[loop.run_in_executor(None, todo.is_task_modified, x, todo_dict) for x in items]
+        )
+        items = [x for x, is_modified in zip(items, modified) if is_modified]
+        await asyncio.gather(
+            *[self.sync_task(x, project_dict, todo_dict, page_id) for x in items]
+        )
+
+    async def sync_task(self, item, project_dict, todo_dict, page_id=None):
+        """同步一个任务以及它的子任务"""
+        id = item.get("id")
+        try:
+            result, fingerprint = await self.write_task(
+                item, project_dict, todo_dict, page_id
+            )
+        except APIResponseError as e:
+            # 关联的标签或者日期页面已经被删除，清除缓存之后重新生成属性
+            if not self.notion_helper.evict_stale_relations(e):
+                raise
+            self.relation_tasks.clear()
+            print(f"关联的页面已经失效，重新获取 {id}")
+            result, fingerprint = await self.write_task(
+                item, project_dict, todo_dict, page_id
+            )
+        todo_dict[id] = result
+        todo.save_page("task", result, fingerprint)
+        if item.get("items"):
+            await self.add_task_to_notion(
+                item.get("items"), project_dict, todo_dict, result.get("id")
+            )
+
+    async def write_task(self, item, project_dict, todo_dict, page_id=None):
+        """更新或者创建任务页面，返回页面和内容指纹"""
+        id = item.get("id")
+        # relation通常已经提前获取，但是笔记修改时间、成员以及失效之后重新获取的relation
+        # 仍然是同步请求，放到线程池中执行，避免阻塞事件循环
+        properties, icon, notes, fingerprint = await asyncio.get_running_loop().run_in_executor(
+            None, todo.build_task, item, project_dict, todo_dict, page_id
+        )
+        parent = {
+            "database_id": self.notion_helper.todo_database_id,
+            "type": "database_id",
+        }
+        result = None
+        if id in todo_dict:
+            page = todo_dict.get(id)
+            changed = todo.get_changed_properties(properties, page)
+            kwargs = {}
+            if (page.get("icon") or {}).get("external", {}).get("url") != icon:
+                kwargs["icon"] = utils.get_icon(icon)
+            try:
+                if changed or kwargs:
+                    result = await self.write_page(
+                        self.client.pages.update,
+                        self.notion_helper.todo_database_id,
+                        changed,
+                        page_id=page.get("id"),
+                        **kwargs,
+                    )
+                else:
+                    result = page
+            except Exception as e:
+                if not todo.is_page_missing(e) or self.notion_helper.get_stale_relation_keys(e):
+                    raise
+                print(f"页面已经被删除，重新创建 {id}")
+        record = self.sync_state.get("task", id)
+        if result is None:
+            result, fingerprint = await self.create_task_page(
+                item, parent, properties, utils.get_icon(icon), notes, fingerprint
+            )
+        elif record is None or record.get("fingerprint") != fingerprint:
+            try:
+                blocks = await self.get_blocks(item, notes)
+                await self.update_page_content(
+                    result.get("id"), blocks, item.get("projectId"), id
+                )
+            except Exception as e:
+                print(f"追加块时发生异常: {e}")
+                fingerprint = None
+        else:
+            fingerprint = None
+        return result, fingerprint
+
+    async def delete_task_from_notion(self, deleted_ids, todo_dict):
+        """删除在滴答清单中已经删除的任务"""
+        for id in deleted_ids:
+            page = todo_dict.pop(id, None)
+            if page is None:
+                continue
+            try:
+                await self.call(self.client.blocks.delete, block_id=page.get("id"))
+            except Exception as e:
+                print(f"删除任务失败 {id}: {e}")
+            self.sync_state.delete("task", id)
+
+    async def run(self, full=False):
+        config = self.notion_helper.config
+        if not await self.login(config.get("滴答清单账号"), config.get("滴答清单密码")):
+            return
+        sync_time = pendulum.now("UTC").to_iso8601_string()
+        project_dict, todo_dict = todo.load_state(full)
+        await self.get_projects(project_dict)
+        tasks, deleted_ids, meta = await self.get_task(full)
+        await self.prefetch_relations(tasks)
+        await self.add_task_to_notion(tasks, project_dict, todo_dict)
+        await self.delete_task_from_notion(deleted_ids, todo_dict)
+        for key, value in meta.items():
+            self.sync_state.set_meta(key, value)
+        self.sync_state.set_meta("last_sync_time", sync_time)
+
+
+async def async_main(full=False, concurrency=10):
+    syncer = AsyncTodo(concurrency)
+    try:
+        await syncer.run(full)
+    finally:
+        await syncer.close()
+
+
+def main(args):
+    asyncio.run(async_main(args.full, args.concurrency))
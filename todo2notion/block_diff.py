@@ -0,0 +1,174 @@
+import difflib
+import hashlib
+import json
+import os
+from urllib.parse import unquote, urlparse
+
+# 可以直接通过blocks.update修改内容的块
+UPDATABLE_TYPES = {
+    "paragraph",
+    "heading_1",
+    "heading_2",
+    "heading_3",
+    "bulleted_list_item",
+    "numbered_list_item",
+    "quote",
+    "to_do",
+    "toggle",
+    "callout",
+    "code",
+    "equation",
+}
+
+ANNOTATIONS = ("bold", "italic", "strikethrough", "underline", "code")
+
+
+def normalize_rich_text(rich_text):
+    """把rich_text转换成可以比较的列表，合并格式相同的相邻文本"""
+    result = []
+    for item in rich_text or []:
+        type = item.get("type", "text")
+        if type == "equation":
+            result.append(("equation", item.get("equation").get("expression")))
+            continue
+        if type == "text":
+            text = item.get("text")
+            content = text.get("content", "")
+            link = (text.get("link") or {}).get("url")
+        else:
+            content = item.get("plain_text", "")
+            link = item.get("href")
+        annotations = item.get("annotations") or {}
+        style = tuple(bool(annotations.get(x)) for x in ANNOTATIONS) + (link,)
+        if result and result[-1][0] == "text" and result[-1][2] == style:
+            result[-1] = ("text", result[-1][1] + content, style)
+        else:
+            result.append(("text", content, style))
+    return result
+
+
+def get_file_name(block):
+    """获取图片等文件块的文件名"""
+    content = block.get(block.get("type"))
+    url = (content.get(content.get("type") or "external") or {}).get("url")
+    if url is None:
+        url = (content.get("external") or {}).get("url", "")
+    return os.path.basename(unquote(urlparse(url).path))
+
+
+def get_block_key(block):
+    """块的类型和内容的hash，用于匹配新旧两个块"""
+    type = block.get("type")
+    content = block.get(type) or {}
+    if type == "equation":
+        value = content.get("expression")
+    elif type in ("image", "file", "pdf", "video", "audio"):
+        value = [get_file_name(block), normalize_rich_text(content.get("caption"))]
+    elif type == "code":
+        value = [content.get("language"), normalize_rich_text(content.get("rich_text"))]
+    elif type == "to_do":
+        value = [content.get("checked"), normalize_rich_text(content.get("rich_text"))]
+    else:
+        value = normalize_rich_text(content.get("rich_text"))
+    digest = hashlib.md5(
+        json.dumps(value, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    return type, digest
+
+
+def get_children(block):
+    """获取块的子块，新生成的块子块在类型对象中，从Notion获取的块子块在children中"""
+    if "children" in block:
+        return block.get("children")
+    return (block.get(block.get("type")) or {}).get("children") or []
+
+
+def get_update_payload(block):
+    """生成更新块时需要的参数，不包含子块"""
+    type = block.get("type")
+    content = {k: v for k, v in block.get(type).items() if k != "children"}
+    return {type: content}
+
+
+def diff_blocks(new_blocks, old_blocks, parent_id):
+    """
+    计算把Notion中已有的块变成新生成的块需要的最少操作。
+    old_blocks需要包含递归获取的children，返回的操作有三种：
+    update（更新块的内容）、insert（在after之后插入块）、delete（删除块）。
+    """
+    new_keys = [get_block_key(x) for x in new_blocks]
+    old_keys = [get_block_key(x) for x in old_blocks]
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+    operations = []
+    after = None
+    # Notion只能在某个块之后插入，插入到最前面时如果后面还有保留的块只能整体重写
+    head_insert = False
+
+    def flush(pending):
+        nonlocal head_insert
+        if pending:
+            if after is None:
+                head_insert = True
+            operations.append(
+                {"op": "insert", "parent_id": parent_id, "after": after, "blocks": pending}
+            )
+        return []
+
+    def keep(old, new):
+        nonlocal after
+        if head_insert:
+            raise _Rewrite()
+        operations.extend(diff_children(new, old))
+        after = old.get("id")
+
+    try:
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for old, new in zip(old_blocks[i1:i2], new_blocks[j1:j2]):
+                    keep(old, new)
+                continue
+            old_part = old_blocks[i1:i2]
+            new_part = new_blocks[j1:j2]
+            pending = []
+            for k in range(max(len(old_part), len(new_part))):
+                old = old_part[k] if k < len(old_part) else None
+                new = new_part[k] if k < len(new_part) else None
+                if (
+                    old is not None
+                    and new is not None
+                    and old.get("type") == new.get("type")
+                    and new.get("type") in UPDATABLE_TYPES
+                ):
+                    pending = flush(pending)
+                    operations.append(
+                        {
+                            "op": "update",
+                            "block_id": old.get("id"),
+                            "block": get_update_payload(new),
+                        }
+                    )
+                    keep(old, new)
+                    continue
+                if old is not None:
+                    operations.append({"op": "delete", "block_id": old.get("id")})
+                if new is not None:
+                    pending.append(new)
+            flush(pending)
+    except _Rewrite:
+        operations = [{"op": "delete", "block_id": x.get("id")} for x in old_blocks]
+        if new_blocks:
+            operations.append(
+                {"op": "insert", "parent_id": parent_id, "after": None, "blocks": new_blocks}
+            )
+    return operations
+
+
+def diff_children(new, old):
+    if "has_children" in new and "children" not in new:
+        # 从笔记中复制的块没有获取子块，不处理子块
+        return []
+    return diff_blocks(get_children(new), old.get("children") or [], old.get("id"))
+
+
+class _Rewrite(Exception):
+    pass
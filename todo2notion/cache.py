@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import time
+
+from todo2notion.config import CACHE_DIR
+
+
+class JsonCache:
+    """持久化到磁盘的JSON缓存，每个key单独记录写入时间，超过ttl视为失效，ttl为None时不失效"""
+
+    def __init__(self, name, ttl):
+        self.path = os.path.join(CACHE_DIR, f"{name}.json")
+        self.ttl = ttl
+        self.data = {}
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取缓存失败 {self.path}: {e}")
+            self.data = {}
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry.get("time", 0) > self.ttl:
+            return None
+        return entry.get("value")
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = {"time": time.time(), "value": value}
+            self._save()
+
+    def update(self, values):
+        """一次写入多个key，只保存一次文件"""
+        with self.lock:
+            now = time.time()
+            for key, value in values.items():
+                self.data[key] = {"time": now, "value": value}
+            self._save()
+
+    def prune(self):
+        """删除已经失效的key，避免缓存文件一直变大"""
+        if self.ttl is None:
+            return
+        with self.lock:
+            now = time.time()
+            expired = [
+                key
+                for key, entry in self.data.items()
+                if now - entry.get("time", 0) > self.ttl
+            ]
+            if expired:
+                for key in expired:
+                    self.data.pop(key)
+                self._save()
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+            self._save()
+
+    def clear(self):
+        with self.lock:
+            self.data = {}
+            self._save()
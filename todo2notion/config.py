@@ -1,3 +1,4 @@
+import os
 
 RICH_TEXT = "rich_text"
 URL = "url"
@@ -10,3 +11,27 @@ TITLE = "title"
 SELECT = "select"
 MULTI_SELECT = "multi_select"
 TZ = "Asia/Shanghai"
+
+TAG_ICON_URL = "https://www.notion.so/icons/tag_gray.svg"
+USER_ICON_URL = "https://www.notion.so/icons/user-circle-filled_gray.svg"
+TARGET_ICON_URL = "https://www.notion.so/icons/target_red.svg"
+BOOKMARK_ICON_URL = "https://www.notion.so/icons/bookmark_gray.svg"
+
+# 本地缓存目录，Github Action中用actions/cache保存，下次运行时复用，不提交到仓库
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+# database结构、用户等元数据缓存的有效期（秒）
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", 24 * 60 * 60))
+# 每隔多少天全量核对一次已完成任务的历史
+FULL_SYNC_DAYS = int(os.getenv("FULL_SYNC_DAYS", 30))
+# relation页面索引每隔多久全量重建一次（秒），期间只读取新修改的页面
+RELATION_INDEX_TTL = int(os.getenv("RELATION_INDEX_TTL", 7 * 24 * 60 * 60))
+# Markdown转换结果缓存的有效期（秒），内容没有变化时不再重复解析
+MARKDOWN_CACHE_TTL = int(os.getenv("MARKDOWN_CACHE_TTL", 30 * 24 * 60 * 60))
+# Notion的last_edited_time精确到分钟，按照修改时间查询时向前多查询一段时间（秒）
+LAST_EDITED_TIME_MARGIN = 120
+# 查找页面中的database时同时请求的块数量
+DISCOVERY_WORKERS = int(os.getenv("DISCOVERY_WORKERS", 4))
+# 同时下载和上传的附件数量
+ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", 4))
+# 多部分上传时同时发送的分块数量
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))
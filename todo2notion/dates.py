@@ -0,0 +1,83 @@
+"""
+滴答清单时间的解析。
+
+滴答清单返回的时间格式固定，例如"2024-01-15T16:00:00.000+0000"，
+把时区改成"+00:00"之后可以直接用datetime.fromisoformat解析，其他格式再交给pendulum。
+同一个时间在一次同步中会被用到很多次，解析结果按照字符串缓存。
+"""
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import NamedTuple
+
+from todo2notion.config import TZ
+
+CHINESE_WEEKDAYS = (
+    "星期一",
+    "星期二",
+    "星期三",
+    "星期四",
+    "星期五",
+    "星期六",
+    "星期日",
+)
+# "+0000"这样没有冒号的时区，Python 3.11之前的fromisoformat不支持
+OFFSET_PATTERN = re.compile(r"([+-]\d{2})(\d{2})$")
+
+_timezone = None
+
+
+def get_timezone():
+    """时区对象只创建一次"""
+    global _timezone
+    if _timezone is None:
+        import pendulum
+
+        _timezone = pendulum.timezone(TZ)
+    return _timezone
+
+
+class DidaDate(NamedTuple):
+    # 时间戳（秒）
+    timestamp: int
+    # 北京时间
+    local: datetime
+    # 年、周、月、日relation页面的标题
+    year: str
+    week: str
+    month: str
+    day: str
+    # 中文星期
+    weekday: str
+
+
+def from_datetime(date):
+    """根据北京时间生成DidaDate，没有时区的datetime当作北京时间"""
+    if date.tzinfo is None:
+        timestamp = int(date.replace(tzinfo=get_timezone()).timestamp())
+    else:
+        timestamp = int(date.timestamp())
+    iso_year, iso_week, _ = date.isocalendar()
+    return DidaDate(
+        timestamp=timestamp,
+        local=date,
+        year=str(date.year),
+        week=f"{iso_year}年第{iso_week}周",
+        month=f"{date.year}年{date.month}月",
+        day=f"{date.year}年{date.month:02d}月{date.day:02d}日",
+        weekday=CHINESE_WEEKDAYS[date.weekday()],
+    )
+
+
+@lru_cache(maxsize=8192)
+def parse(value):
+    """解析滴答清单的时间字符串，没有时区的时间按照UTC处理"""
+    try:
+        date = datetime.fromisoformat(OFFSET_PATTERN.sub(r"\1:\2", value))
+    except ValueError:
+        import pendulum
+
+        date = pendulum.parse(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return from_datetime(date.astimezone(get_timezone()))
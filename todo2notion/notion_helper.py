@@ -1,12 +1,28 @@
+import json
 import logging
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from notion_client import Client
-from retrying import retry
-from datetime import datetime, timedelta
+import httpx
+from notion_client import APIErrorCode, APIResponseError, Client
+from datetime import datetime, timedelta, timezone
 
+from todo2notion import dates, transport
+from todo2notion.cache import JsonCache
+from todo2notion.config import (
+    BOOKMARK_ICON_URL,
+    DISCOVERY_WORKERS,
+    LAST_EDITED_TIME_MARGIN,
+    METADATA_CACHE_TTL,
+    RELATION_INDEX_TTL,
+    TAG_ICON_URL,
+    TARGET_ICON_URL,
+    USER_ICON_URL,
+)
+from todo2notion.rate_limit import RateLimitedTransport, notion_retry
 from todo2notion.utils import (
     format_date,
     get_date,
@@ -16,15 +32,40 @@ from todo2notion.utils import (
     get_icon,
     get_relation,
     get_title,
+    compile_property_encoder,
     get_property_value
 )
 from dotenv import load_dotenv
 
 load_dotenv()
-TAG_ICON_URL = "https://www.notion.so/icons/tag_gray.svg"
-USER_ICON_URL = "https://www.notion.so/icons/user-circle-filled_gray.svg"
-TARGET_ICON_URL = "https://www.notion.so/icons/target_red.svg"
-BOOKMARK_ICON_URL = "https://www.notion.so/icons/bookmark_gray.svg"
+# Notion请求限制 https://developers.notion.com/reference/request-limits
+MAX_BLOCKS_PER_REQUEST = 100
+MAX_ELEMENTS_PER_REQUEST = 1000
+# 请求体最大500KB，留出一些余量
+MAX_PAYLOAD_SIZE = 450 * 1024
+# 任务database中relation属性名和对应database id字段的映射
+RELATION_DATABASE_DICT = {
+    "project_database_id": "清单",
+    "tag_database_id": "标签",
+    "day_database_id": "日",
+    "week_database_id": "周",
+    "month_database_id": "月",
+    "year_database_id": "年",
+    "all_database_id": "全部",
+    "note_database_id": "笔记",
+}
+UUID_PATTERN = re.compile(
+    r"[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}"
+)
+# 启动时一次性读取的database，建立标题到页面id的索引
+RELATION_INDEX_DATABASES = (
+    "tag_database_id",
+    "year_database_id",
+    "month_database_id",
+    "week_database_id",
+    "day_database_id",
+    "all_database_id",
+)
 
 
 class NotionHelper:
@@ -37,29 +78,38 @@ class NotionHelper:
     tomato_heatmap_block_id = None
     property_dict = {}
     def __init__(self):
-        self.client = Client(auth=os.getenv("NOTION_TOKEN"), log_level=logging.ERROR)
-        self.__cache = {}
+        # 所有请求都经过共用的限流器和连接池
+        self.client = Client(
+            auth=os.getenv("NOTION_TOKEN"),
+            log_level=logging.ERROR,
+            timeout_ms=int(transport.TIMEOUT * 1000),
+            client=httpx.Client(transport=RateLimitedTransport()),
+        )
+        # notion_client用timeout_ms覆盖了httpx client的超时，这里重新设置连接超时
+        self.client.client.timeout = transport.get_timeout()
+        # relation页面的id，按照database id和标题持久化到磁盘，页面失效时再清除
+        self.relations = JsonCache("relations", None)
+        # 多线程同步时保护缓存，同一个relation页面只查询和创建一次
+        self.__lock = threading.RLock()
+        self.__key_locks = {}
+        # 已经通过load_relation_index建立索引的database
+        self.__indexed = set()
+        # 按照database id缓存的property转换函数
+        self.__encoders = {}
         self.page_id = self.extract_page_id(os.getenv("NOTION_PAGE"))
-        self.search_database(self.page_id)
         for key in self.database_name_dict.keys():
             if os.getenv(key) != None and os.getenv(key) != "":
                 self.database_name_dict[key] = os.getenv(key)
+        self.discovery = JsonCache("discovery", METADATA_CACHE_TTL)
+        self.discover()
         self.todo_database_id = self.database_id_dict.get(
             self.database_name_dict.get("TODO_DATABASE_NAME")
         )     
         self.setting_database_id = self.database_id_dict.get(
             self.database_name_dict.get("SETTING_DATABASE_NAME")
         )     
-        r = self.client.databases.retrieve(database_id=self.todo_database_id)
-        for key,value in r.get("properties").items():
-            self.property_dict[key] = value
-        self.project_database_id = self.get_relation_database_id(self.property_dict.get("清单"))
-        self.tag_database_id = self.get_relation_database_id(self.property_dict.get("标签"))
-        self.day_database_id = self.get_relation_database_id(self.property_dict.get("日"))
-        self.week_database_id = self.get_relation_database_id(self.property_dict.get("周"))
-        self.month_database_id = self.get_relation_database_id(self.property_dict.get("月"))
-        self.year_database_id = self.get_relation_database_id(self.property_dict.get("年"))
-        self.all_database_id = self.get_relation_database_id(self.property_dict.get("全部"))
+        self.metadata = JsonCache("metadata", METADATA_CACHE_TTL)
+        self.load_metadata()
         if self.day_database_id:
             self.write_database_id(self.day_database_id)
         self.config = self.query_setting_data()
@@ -85,15 +135,95 @@ class NotionHelper:
                result[key] = get_property_value(value)
         return result
     
+    def load_metadata(self, refresh=False):
+        """加载任务database的结构以及relation对应的database id，优先使用缓存"""
+        self.property_dict = self.get_database_properties(
+            self.todo_database_id, refresh=refresh
+        )
+        key = f"relation_database_ids:{self.todo_database_id}"
+        relation_database_ids = None if refresh else self.metadata.get(key)
+        if relation_database_ids is None or set(RELATION_DATABASE_DICT) - set(
+            relation_database_ids
+        ):
+            relation_database_ids = {
+                name: self.get_relation_database_id(self.property_dict.get(value))
+                for name, value in RELATION_DATABASE_DICT.items()
+            }
+            self.metadata.set(key, relation_database_ids)
+        for name, value in relation_database_ids.items():
+            setattr(self, name, value)
+
+    def get_database_properties(self, database_id, refresh=False):
+        """获取一个database的property定义，优先读取缓存"""
+        key = f"properties:{database_id}"
+        properties = None if refresh else self.metadata.get(key)
+        if properties is None:
+            with self.__lock:
+                properties = None if refresh else self.metadata.get(key)
+                if properties is None:
+                    r = self.client.databases.retrieve(database_id=database_id)
+                    properties = r.get("properties")
+                    self.metadata.set(key, properties)
+        return properties
+
     def get_property_type(self,database_id):
         """获取一个database的property和类型的映射关系"""
         result = {}
-        r = self.client.databases.retrieve(database_id=database_id)
-        for key,value in r.get("properties").items():
+        for key,value in self.get_database_properties(database_id).items():
             result[key] = value.get("type")
         return result
+
+    def get_property_encoder(self, database_id):
+        """获取一个database的property转换函数，每个database只生成一次"""
+        encoder = self.__encoders.get(database_id)
+        if encoder is None:
+            encoder = compile_property_encoder(self.get_property_type(database_id))
+            self.__encoders[database_id] = encoder
+        return encoder
+
+    def get_persons(self):
+        """获取工作区中所有的成员（不包含机器人）"""
+        persons = self.metadata.get("persons")
+        if persons is None:
+            with self.__lock:
+                persons = self.metadata.get("persons")
+                if persons is None:
+                    persons = [
+                        x
+                        for x in self.client.users.list().get("results")
+                        if x.get("type") == "person"
+                    ]
+                    self.metadata.set("persons", persons)
+        return persons
+
     def get_relation_database_id(self,property):
+        if property is None:
+            return None
         return property.get('relation').get("database_id")
+
+    def is_schema_error(self, error, database_id, properties):
+        """
+        判断参数错误是否由database结构变化引起：要写入的属性不在缓存的结构中，
+        或者报错信息中提到了某个属性。子块格式错误、relation页面失效等其他参数错误不刷新缓存。
+        属性名需要完整匹配，"id"这样的属性名不能匹配到"validation"中。
+        """
+        if error.code != APIErrorCode.ValidationError or not database_id:
+            return False
+        schema = self.get_database_properties(database_id)
+        if any(key not in schema for key in properties):
+            return True
+        message = str(error)
+        return any(
+            re.search(rf"(?<!\w){re.escape(key)}(?!\w)", message) for key in properties
+        )
+
+    def remove_unknown_properties(self, database_id, properties):
+        """重新获取database的结构，移除已经不存在的属性"""
+        print("database结构发生变化，刷新缓存")
+        schema = self.get_database_properties(database_id, refresh=True)
+        self.__encoders.pop(database_id, None)
+        return {key: value for key, value in properties.items() if key in schema}
+
     def write_database_id(self, database_id):
         env_file = os.getenv('GITHUB_ENV')
         # 将值写入环境文件
@@ -110,106 +240,297 @@ class NotionHelper:
         else:
             raise Exception(f"获取NotionID失败，请检查输入的Url是否正确")
 
+    def discover(self):
+        """查找页面中的database和热力图，优先使用缓存，缓存中的块失效时重新查找"""
+        result = self.discovery.get(self.page_id)
+        if result and self.is_discovery_valid(result):
+            self.database_id_dict.update(result.get("database_id_dict"))
+            self.todo_heatmap_block_id = result.get("todo_heatmap_block_id")
+            self.tomato_heatmap_block_id = result.get("tomato_heatmap_block_id")
+            return
+        self.search_database(self.page_id)
+        self.discovery.set(
+            self.page_id,
+            {
+                "database_id_dict": self.database_id_dict,
+                "todo_heatmap_block_id": self.todo_heatmap_block_id,
+                "tomato_heatmap_block_id": self.tomato_heatmap_block_id,
+            },
+        )
+
+    def is_discovery_valid(self, result):
+        """只检查需要用到的database和热力图是否还存在"""
+        database_id_dict = result.get("database_id_dict") or {}
+        ids = [database_id_dict.get(x) for x in self.database_name_dict.values()]
+        if None in ids:
+            return False
+        if result.get("todo_heatmap_block_id"):
+            ids.append(result.get("todo_heatmap_block_id"))
+        for id in ids:
+            try:
+                block = self.client.blocks.retrieve(block_id=id)
+            except APIResponseError as e:
+                if e.code == APIErrorCode.ObjectNotFound:
+                    return False
+                raise
+            if block.get("archived") or block.get("in_trash"):
+                return False
+        return True
+
+    def is_discovered(self):
+        """需要的database和热力图都已经找到"""
+        return self.todo_heatmap_block_id is not None and all(
+            x in self.database_id_dict for x in self.database_name_dict.values()
+        )
+
     def search_database(self, block_id):
-        children = self.client.blocks.children.list(block_id=block_id)["results"]
-        # 遍历子块
-        for child in children:
-            # 检查子块的类型
-
-            if child["type"] == "child_database":
-                self.database_id_dict[child.get("child_database").get("title")] = (
-                    child.get("id")
-                )
-            elif child["type"] == "embed" and child.get("embed").get("url"):
-                url =    child.get("embed").get("url")
-                if url.startswith("https://heatmap.malinkang.com/"):
-                    if("/tomato/" in url):
-                        self.tomato_heatmap_block_id = child.get("id")
-                    else:
-                        self.todo_heatmap_block_id = child.get("id")
-            # 如果子块有子块，递归调用函数
-            if "has_children" in child and child["has_children"]:
-                self.search_database(child["id"])
-
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+        """广度优先并行遍历页面中的块，需要的database和热力图都找到之后提前结束"""
+        level = [block_id]
+        with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+            while level and not self.is_discovered():
+                next_level = []
+                futures = [executor.submit(self.get_block_children, x) for x in level]
+                for future in as_completed(futures):
+                    for child in future.result():
+                        self.add_discovered_block(child)
+                        if child.get("has_children"):
+                            next_level.append(child.get("id"))
+                    if self.is_discovered():
+                        for x in futures:
+                            x.cancel()
+                        break
+                level = next_level
+
+    def add_discovered_block(self, child):
+        if child["type"] == "child_database":
+            self.database_id_dict.setdefault(
+                child.get("child_database").get("title"), child.get("id")
+            )
+        elif child["type"] == "embed" and child.get("embed").get("url"):
+            url = child.get("embed").get("url")
+            if url.startswith("https://heatmap.malinkang.com/"):
+                if "/tomato/" in url:
+                    self.tomato_heatmap_block_id = child.get("id")
+                else:
+                    self.todo_heatmap_block_id = child.get("id")
+
+    @notion_retry
     def update_heatmap(self, block_id, url):
         # 更新 image block 的链接
         return self.client.blocks.update(block_id=block_id, embed={"url": url})
     
-    def get_week_relation_id(self, date):
-        year = date.isocalendar().year
-        week = date.isocalendar().week
-        week = f"{year}年第{week}周"
-        start, end = get_first_and_last_day_of_week(date)
+    def get_week_relation_args(self, date):
+        start, end = get_first_and_last_day_of_week(date.local)
         properties = {"日期": get_date(format_date(start), format_date(end))}
-        return self.get_relation_id(
-            week, self.week_database_id, TARGET_ICON_URL, properties
-        )
+        return date.week, self.week_database_id, TARGET_ICON_URL, properties
 
-    def get_month_relation_id(self, date):
-        month = date.strftime("%Y年%-m月")
-        start, end = get_first_and_last_day_of_month(date)
+    def get_month_relation_args(self, date):
+        start, end = get_first_and_last_day_of_month(date.local)
         properties = {"日期": get_date(format_date(start), format_date(end))}
-        return self.get_relation_id(
-            month, self.month_database_id, TARGET_ICON_URL, properties
-        )
+        return date.month, self.month_database_id, TARGET_ICON_URL, properties
 
-    def get_year_relation_id(self, date):
-        year = date.strftime("%Y")
-        start, end = get_first_and_last_day_of_year(date)
+    def get_year_relation_args(self, date):
+        start, end = get_first_and_last_day_of_year(date.local)
         properties = {"日期": get_date(format_date(start), format_date(end))}
-        return self.get_relation_id(
-            year, self.year_database_id, TARGET_ICON_URL, properties
-        )
+        return date.year, self.year_database_id, TARGET_ICON_URL, properties
 
-    def get_day_relation_id(self, date):
-        new_date = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day = new_date.strftime("%Y年%m月%d日")
+    def get_day_relation_args(self, date):
         properties = {
-            "日期": get_date(format_date(date)),
+            "日期": get_date(format_date(date.local)),
         }
-        return self.get_relation_id(
-            day, self.day_database_id, TARGET_ICON_URL, properties
-        )
+        return date.day, self.day_database_id, TARGET_ICON_URL, properties
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
-    def get_relation_id(self, name, id, icon, properties={}):
-        key = f"{id}{name}"
-        if key in self.__cache:
-            return self.__cache.get(key)
-        filter = {"property": "标题", "title": {"equals": name}}
-        response = self.client.databases.query(database_id=id, filter=filter)
-        if len(response.get("results")) == 0:
-            parent = {"database_id": id, "type": "database_id"}
-            properties["标题"] = get_title(name)
-            page_id = self.client.pages.create(
-                parent=parent, properties=properties, icon=get_icon(icon)
-            ).get("id")
-        else:
-            page_id = response.get("results")[0].get("id")
-        self.__cache[key] = page_id
-        return page_id
+    def get_date_relation_args(self, date):
+        """获取年、月、周、日relation页面的标题、database id、图标和属性，date是dates.DidaDate"""
+        return {
+            "年": self.get_year_relation_args(date),
+            "月": self.get_month_relation_args(date),
+            "周": self.get_week_relation_args(date),
+            "日": self.get_day_relation_args(date),
+        }
+
+    def get_week_relation_id(self, date):
+        return self.get_relation_id(*self.get_week_relation_args(date))
+
+    def get_month_relation_id(self, date):
+        return self.get_relation_id(*self.get_month_relation_args(date))
+
+    def get_year_relation_id(self, date):
+        return self.get_relation_id(*self.get_year_relation_args(date))
+
+    def get_day_relation_id(self, date):
+        return self.get_relation_id(*self.get_day_relation_args(date))
+
+    def get_relation_key(self, name, id):
+        return f"{id}:{name}"
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    def get_cached_relation_id(self, name, id):
+        return self.relations.get(self.get_relation_key(name, id))
+
+    def set_cached_relation_id(self, name, id, page_id):
+        self.relations.set(self.get_relation_key(name, id), page_id)
+
+    def get_relation_id(self, name, id, icon, properties=None):
+        key = self.get_relation_key(name, id)
+        page_id = self.relations.get(key)
+        if page_id:
+            return page_id
+        with self.__lock:
+            key_lock = self.__key_locks.setdefault(key, threading.Lock())
+        # 同一个页面同时只有一个线程查询和创建，其他线程等待之后直接读取缓存
+        with key_lock:
+            page_id = self.relations.get(key)
+            if page_id:
+                return page_id
+            page_id = self.query_relation_id(name, id, icon, properties)
+            self.relations.set(key, page_id)
+            return page_id
+
+    @notion_retry
+    def query_relation_id(self, name, id, icon, properties=None):
+        # 已经建立索引的database中不存在的页面直接创建
+        if id not in self.__indexed:
+            filter = {"property": "标题", "title": {"equals": name}}
+            response = self.client.databases.query(database_id=id, filter=filter)
+            if response.get("results"):
+                return response.get("results")[0].get("id")
+        return self.create_relation_page(name, id, icon, properties)
+
+    def get_stale_relation_keys(self, error):
+        """Notion报错中提到的relation页面已经被删除或者归档时，返回对应的缓存key"""
+        if not isinstance(error, APIResponseError) or error.code not in (
+            APIErrorCode.ObjectNotFound,
+            APIErrorCode.ValidationError,
+        ):
+            return []
+        ids = {x.replace("-", "") for x in UUID_PATTERN.findall(str(error))}
+        if not ids:
+            return []
+        return [
+            key
+            for key, entry in list(self.relations.data.items())
+            if isinstance(entry.get("value"), str)
+            and entry.get("value").replace("-", "") in ids
+        ]
+
+    def evict_stale_relations(self, error):
+        """清除失效的relation页面缓存，返回是否有缓存被清除"""
+        keys = self.get_stale_relation_keys(error)
+        if keys:
+            self.relations.delete(*keys)
+        return bool(keys)
+
+    @notion_retry
+    def create_relation_page(self, name, id, icon, properties=None):
+        parent = {"database_id": id, "type": "database_id"}
+        properties = dict(properties or {})
+        properties["标题"] = get_title(name)
+        return self.client.pages.create(
+            parent=parent, properties=properties, icon=get_icon(icon)
+        ).get("id")
+
+    def is_indexed(self, database_id):
+        return database_id in self.__indexed
+
+    def load_relation_index(self):
+        """
+        分页读取标签和日期database中的页面，建立标题到页面id的索引并保存到磁盘。
+        之后的运行只读取上次之后修改过的页面，每隔RELATION_INDEX_TTL全量重建一次。
+        """
+        now = time.time()
+        for name in RELATION_INDEX_DATABASES:
+            database_id = getattr(self, name, None)
+            if not database_id:
+                continue
+            index_key = f"index:{database_id}"
+            index = self.relations.get(index_key) or {}
+            full = now - index.get("full", 0) > RELATION_INDEX_TTL
+            filter = None
+            if not full:
+                # last_edited_time只精确到分钟，多往前读取一些
+                since = datetime.fromtimestamp(
+                    index.get("last") - LAST_EDITED_TIME_MARGIN, timezone.utc
+                )
+                filter = {
+                    "timestamp": "last_edited_time",
+                    "last_edited_time": {"on_or_after": since.isoformat()},
+                }
+            values = {}
+            for page in self.query_all(database_id, filter=filter):
+                title = page.get("properties").get("标题") or {}
+                title = "".join(x.get("plain_text") for x in title.get("title") or [])
+                if title:
+                    values.setdefault(
+                        self.get_relation_key(title, database_id), page.get("id")
+                    )
+            if full:
+                prefix = f"{database_id}:"
+                self.relations.delete(
+                    *[x for x in list(self.relations.data) if x.startswith(prefix)]
+                )
+            values[index_key] = {"full": now if full else index.get("full"), "last": now}
+            self.relations.update(values)
+            self.__indexed.add(database_id)
+
+    def create_calendar_pages(self, start_year, end_year, workers=1):
+        """一次性创建年份范围内所有缺少的年、月、周、日页面，需要先调用load_relation_index"""
+        missing = {}
+        date = datetime(start_year, 1, 1)
+        while date.year <= end_year:
+            for args in self.get_date_relation_args(dates.from_datetime(date)).values():
+                name, id = args[0], args[1]
+                if id and self.get_cached_relation_id(name, id) is None:
+                    missing.setdefault((name, id), args)
+            date += timedelta(days=1)
+        print(f"需要创建{len(missing)}个日期页面")
+
+        def create(args):
+            return self.get_relation_key(args[0], args[1]), self.create_relation_page(*args)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            self.relations.update(dict(executor.map(create, missing.values())))
+        return len(missing)
+
+    @notion_retry
     def update_book_page(self, page_id, properties):
         return self.client.pages.update(page_id=page_id, properties=properties)
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
-    def update_page(self, page_id, properties,icon):
-        return self.client.pages.update(page_id=page_id, properties=properties,icon=icon)
+    @notion_retry
+    def update_page(self, page_id, properties,icon=None, database_id=None):
+        # icon为空时不修改图标
+        kwargs = {"icon": icon} if icon else {}
+        try:
+            return self.client.pages.update(page_id=page_id, properties=properties, **kwargs)
+        except APIResponseError as e:
+            if not self.is_schema_error(e, database_id, properties):
+                raise
+            properties = self.remove_unknown_properties(database_id, properties)
+            return self.client.pages.update(page_id=page_id, properties=properties, **kwargs)
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
-    def create_page(self, parent, properties, icon):
-        return self.client.pages.create(
-            parent=parent, properties=properties, icon=icon
-        )
+    @notion_retry
+    def create_page(self, parent, properties, icon, children=None):
+        # children直接随创建页面的请求发送，需要满足Notion的请求限制
+        kwargs = {"children": children} if children else {}
+        try:
+            return self.client.pages.create(
+                parent=parent, properties=properties, icon=icon, **kwargs
+            )
+        except APIResponseError as e:
+            if not self.is_schema_error(e, parent.get("database_id"), properties):
+                raise
+            properties = self.remove_unknown_properties(
+                parent.get("database_id"), properties
+            )
+            return self.client.pages.create(
+                parent=parent, properties=properties, icon=icon, **kwargs
+            )
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    @notion_retry
     def query(self, **kwargs):
         kwargs = {k: v for k, v in kwargs.items() if v}
         return self.client.databases.query(**kwargs)
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    @notion_retry
     def get_block_children(self, id):
         results = []
         has_more = True
@@ -221,21 +542,127 @@ class NotionHelper:
             has_more = response.get("has_more")
         return results
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    def get_block_tree(self, id):
+        """递归获取块的所有子块，子块放在children中"""
+        results = self.get_block_children(id)
+        for block in results:
+            block["children"] = (
+                self.get_block_tree(block.get("id")) if block.get("has_children") else []
+            )
+        return results
+
+    @notion_retry
+    def update_block(self, block_id, block):
+        return self.client.blocks.update(block_id=block_id, **block)
+
+    @notion_retry
     def append_blocks(self, block_id, children):
         return self.client.blocks.children.append(block_id=block_id, children=children)
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    def split_block(self, block):
+        """
+        拆分一个块，返回可以在一次请求中发送的块（最多两层嵌套）、
+        超过数量限制需要之后追加的子块以及每个子块需要之后追加的孙块。
+        """
+        block = dict(block)
+        type = block.get("type")
+        content = dict(block.get(type) or {})
+        children = content.pop("children", None) or block.pop("children", None) or []
+        block[type] = content
+        inline_children = []
+        nested = {}
+        for index, child in enumerate(children[:MAX_BLOCKS_PER_REQUEST]):
+            child = dict(child)
+            child_type = child.get("type")
+            child_content = dict(child.get(child_type) or {})
+            grandchildren = child_content.pop("children", None) or child.pop(
+                "children", None
+            )
+            child[child_type] = child_content
+            if grandchildren:
+                nested[index] = grandchildren
+            inline_children.append(child)
+        if inline_children:
+            content["children"] = inline_children
+        return block, children[MAX_BLOCKS_PER_REQUEST:], nested
+
+    def pack_blocks(self, blocks):
+        """把块按照Notion的请求限制打包，返回每次请求需要发送的块"""
+        chunks = []
+        chunk = []
+        size = 0
+        count = 0
+        for block in blocks:
+            item = self.split_block(block)
+            block_size = len(json.dumps(item[0], ensure_ascii=False).encode("utf-8"))
+            block_count = 1 + len(item[0][item[0].get("type")].get("children", []))
+            if chunk and (
+                len(chunk) >= MAX_BLOCKS_PER_REQUEST
+                or size + block_size > MAX_PAYLOAD_SIZE
+                or count + block_count > MAX_ELEMENTS_PER_REQUEST
+            ):
+                chunks.append(chunk)
+                chunk = []
+                size = 0
+                count = 0
+            chunk.append(item)
+            size += block_size
+            count += block_count
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def append_deferred_blocks(self, ids, chunk):
+        """父块创建之后再追加一次请求中放不下的子块"""
+        for id, (block, extra_children, nested) in zip(ids, chunk):
+            if nested:
+                children = self.get_block_children(id)
+                for index, grandchildren in nested.items():
+                    self.append_block_tree(children[index].get("id"), grandchildren)
+            if extra_children:
+                self.append_block_tree(id, extra_children)
+
+    def append_packed_blocks(self, block_id, chunks, after=None):
+        """
+        按批追加块，返回最后追加的块的id（没有指定after时返回None）。
+        一批中有Notion不接受的块（比如不支持的代码语言）时逐个追加，只跳过出错的块。
+        """
+        for chunk in chunks:
+            kwargs = {"after": after} if after else {}
+            try:
+                response = self.client.blocks.children.append(
+                    block_id=block_id, children=[x[0] for x in chunk], **kwargs
+                )
+            except APIResponseError as e:
+                if e.code != APIErrorCode.ValidationError:
+                    raise
+                if len(chunk) > 1:
+                    after = self.append_packed_blocks(block_id, [[x] for x in chunk], after)
+                else:
+                    print(f"跳过Notion不接受的块: {e}")
+                continue
+            # 返回结果中是新创建的第一层块
+            ids = [x.get("id") for x in response.get("results")]
+            self.append_deferred_blocks(ids, chunk)
+            if after:
+                after = ids[-1]
+        return after
+
+    def append_block_tree(self, block_id, blocks, after=None):
+        """用尽量少的请求追加块，超过嵌套层级的子块在父块创建之后追加"""
+        self.append_packed_blocks(block_id, self.pack_blocks(blocks), after)
+
+    @notion_retry
     def append_blocks_after(self, block_id, children, after):
         return self.client.blocks.children.append(
             block_id=block_id, children=children, after=after
         )
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    @notion_retry
     def delete_block(self, block_id):
         return self.client.blocks.delete(block_id=block_id)
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    @notion_retry
     def query_all_by_book(self, database_id, filter):
         results = []
         has_more = True
@@ -252,17 +679,19 @@ class NotionHelper:
             results.extend(response.get("results"))
         return results
 
-    @retry(stop_max_attempt_number=3, wait_fixed=5000)
-    def query_all(self, database_id):
+    @notion_retry
+    def query_all(self, database_id, filter=None):
         """获取database中所有的数据"""
         results = []
         has_more = True
         start_cursor = None
+        kwargs = {"filter": filter} if filter else {}
         while has_more:
             response = self.client.databases.query(
                 database_id=database_id,
                 start_cursor=start_cursor,
                 page_size=100,
+                **kwargs,
             )
             start_cursor = response.get("next_cursor")
             has_more = response.get("has_more")
@@ -277,24 +706,5 @@ class NotionHelper:
         )
 
     def get_date_relation(self, properties, date):
-        properties["年"] = get_relation(
-            [
-                self.get_year_relation_id(date),
-            ]
-        )
-        properties["月"] = get_relation(
-            [
-                self.get_month_relation_id(date),
-            ]
-        )
-        properties["周"] = get_relation(
-            [
-                self.get_week_relation_id(date),
-            ]
-        )
-        properties["日"] = get_relation(
-            [
-                self.get_day_relation_id(date),
-            ]
-        )
-
+        for key, args in self.get_date_relation_args(date).items():
+            properties[key] = get_relation([self.get_relation_id(*args)])
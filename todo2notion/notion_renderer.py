@@ -0,0 +1,354 @@
+"""
+基于mistletoe语法树的Markdown转Notion块。
+
+mistletoe只负责块级结构（段落、标题、列表、引用、代码、表格），行内格式仍然交给
+utils.process_inline_formatting处理，生成的块和原来逐行解析的结果一致。
+转换结果按照Markdown内容的hash缓存在内存和磁盘中，内容没有变化的任务不再重复解析。
+"""
+import atexit
+import hashlib
+import json
+import re
+import threading
+
+from mistletoe import block_token, span_token
+from mistletoe.base_renderer import BaseRenderer
+
+from todo2notion.cache import JsonCache
+from todo2notion.config import MARKDOWN_CACHE_TTL
+from todo2notion.utils import (
+    convert_markdown_table_to_latex,
+    process_inline_formatting,
+)
+
+# 转换规则变化时修改版本号，让旧的缓存失效
+RENDERER_VERSION = "4"
+LATEX_BLOCK_PATTERN = re.compile(r"\$\$(.+?)\$\$", re.DOTALL)
+LATEX_PLACEHOLDER_PATTERN = re.compile(r"LATEX_BLOCK_(\d+)")
+IMAGE_PATTERN = re.compile(r"!\[(.*?)\]\((.*?)\)")
+QUOTE_MARKER_PATTERN = re.compile(r" {0,3}>")
+# 和原来逐行解析一样，只有"-"和"1."开头的行是列表
+LIST_MARKER_PATTERN = re.compile(r" *(-|\d{1,9}\.)( |$)")
+FENCE_PATTERN = re.compile(r" *(```|~~~)")
+INDENTED_CODE_PATTERN = re.compile(r" {4}| {0,3}\t")
+BLOCK_START_PATTERN = re.compile(r" {0,3}(#|\|)|-{3,}$")
+# 积累多少条新的转换结果之后写一次磁盘
+FLUSH_SIZE = 50
+
+
+class Paragraph(block_token.Paragraph):
+    """不识别Setext标题，"文字\\n---"仍然是段落加分割线"""
+
+    parse_setext = False
+
+    def __init__(self, lines):
+        # 和原来逐行解析一样保留行首和行尾的空格
+        content = "".join(lines).rstrip("\n")
+        block_token.BlockToken.__init__(self, content, span_token.tokenize_inner)
+
+
+class ThematicBreak(block_token.ThematicBreak):
+    """只有"---"这样的行是分割线，"***"和"___"仍然是段落"""
+
+    pattern = re.compile(r"-{3,}$")
+
+
+class List(block_token.List):
+    """"*"、"+"和"1)"开头的行不是列表，仍然是段落"""
+
+    pattern = re.compile(r" {0,3}(?:\d{1,9}\.|-)(?:[ \t]*$|[ \t]+)")
+
+    @classmethod
+    def check_interrupts_paragraph(cls, lines):
+        return cls.start(lines.peek()) and super().check_interrupts_paragraph(lines)
+
+
+class RawLine(span_token.SpanToken):
+    """整段行内文本作为一个token，RawText会解码"&amp;"这样的HTML实体，这里保留原样"""
+
+    pattern = re.compile(r"(.+)", re.DOTALL)
+    parse_inner = False
+
+    def __init__(self, match):
+        self.content = match.group(0)
+
+
+# 不包含Footnote，"[x]: url"这样的行按照普通段落处理
+BLOCK_TOKENS = [
+    block_token.BlockCode,
+    block_token.Heading,
+    block_token.Quote,
+    block_token.CodeFence,
+    ThematicBreak,
+    List,
+    block_token.Table,
+    Paragraph,
+]
+
+
+def get_text(token):
+    """行内token全部是RawLine，直接拼接原始文本"""
+    return "".join(child.content for child in token.children)
+
+
+def get_block(type, rich_text):
+    return {"object": "block", "type": type, type: {"rich_text": rich_text}}
+
+
+def get_code_block(language, content):
+    return {
+        "object": "block",
+        "type": "code",
+        "code": {
+            "language": language,
+            "rich_text": [{"type": "text", "text": {"content": content}}],
+        },
+    }
+
+
+def get_equation_block(expression):
+    return {"type": "equation", "equation": {"expression": expression}}
+
+
+class NotionRenderer(BaseRenderer):
+    """把mistletoe的Document渲染成Notion块的列表"""
+
+    def __init__(self, latex_blocks):
+        super().__init__()
+        self.latex_blocks = latex_blocks
+
+    def __enter__(self):
+        block_token._token_types = list(BLOCK_TOKENS)
+        # 不解析行内token，保留原始文本交给process_inline_formatting
+        span_token._token_types = [RawLine, span_token.RawText]
+        return self
+
+    def restore_latex(self, text):
+        """不是单独一行的公式还原成原来的文本"""
+        return LATEX_PLACEHOLDER_PATTERN.sub(
+            lambda match: f"$${self.latex_blocks[int(match.group(1))]}$$", text
+        )
+
+    def get_rich_text(self, text):
+        return process_inline_formatting(self.restore_latex(text))
+
+    def render_children(self, token):
+        blocks = []
+        for child in token.children or []:
+            blocks.extend(self.render(child))
+        return blocks
+
+    def render_document(self, token):
+        return self.render_children(token)
+
+    def render_paragraph(self, token):
+        blocks = []
+        for line in get_text(token).split("\n"):
+            match = LATEX_PLACEHOLDER_PATTERN.fullmatch(line.strip())
+            image_match = IMAGE_PATTERN.search(line)
+            if match:
+                blocks.append(get_equation_block(self.latex_blocks[int(match.group(1))]))
+            elif image_match:
+                block = {
+                    "object": "block",
+                    "type": "image",
+                    "image": {"external": {"url": image_match.group(2)}},
+                }
+                caption = image_match.group(1)
+                if caption:
+                    block["image"]["caption"] = [
+                        {"type": "text", "text": {"content": caption, "link": None}}
+                    ]
+                blocks.append(block)
+            elif line.strip():
+                blocks.append(get_block("paragraph", self.get_rich_text(line)))
+        return blocks
+
+    def render_heading(self, token):
+        # Notion只有三级标题，更深的标题按照三级标题处理
+        type = f"heading_{min(token.level, 3)}"
+        return [get_block(type, self.get_rich_text(get_text(token)))]
+
+    def render_quote(self, token):
+        blocks = []
+        for child in token.children:
+            if isinstance(child, block_token.Paragraph):
+                for line in get_text(child).split("\n"):
+                    if line.strip():
+                        blocks.append(get_block("quote", self.get_rich_text(line)))
+            else:
+                blocks.extend(self.render(child))
+        return blocks
+
+    def render_block_code(self, token):
+        content = self.restore_latex(token.content)
+        if isinstance(token, block_token.CodeFence):
+            language = token.language.strip() or "plain text"
+            return [get_code_block(language, content.strip())]
+        return [get_code_block("plain text", content.strip("\n"))]
+
+    def render_thematic_break(self, token):
+        return [{"divider": {}, "type": "divider"}]
+
+    def render_list(self, token):
+        type = "numbered_list_item" if token.start is not None else "bulleted_list_item"
+        return [self.render_list_item(item, type) for item in token.children]
+
+    def render_list_item(self, token, type="bulleted_list_item"):
+        children = list(token.children or [])
+        text = ""
+        if children and isinstance(children[0], block_token.Paragraph):
+            text = get_text(children.pop(0))
+        block = get_block(type, self.get_rich_text(text))
+        nested = []
+        for child in children:
+            nested.extend(self.render(child))
+        if nested:
+            block[type]["children"] = nested
+        return block
+
+    def render_table(self, token):
+        rows = [token.header] + list(token.children)
+        lines = [self.render_table_row(row) for row in rows]
+        lines.insert(1, "|" + "---|" * len(token.column_align))
+        return [get_equation_block(convert_markdown_table_to_latex("\n".join(lines)))]
+
+    def render_table_row(self, token):
+        return "| " + " | ".join(self.render_table_cell(cell) for cell in token.children) + " |"
+
+    def render_table_cell(self, token):
+        return self.restore_latex(get_text(token))
+
+
+class MarkdownCache:
+    """按照Markdown内容的hash缓存转换结果，内存中保存json字符串，返回时重新解析得到新的对象"""
+
+    def __init__(self):
+        self.memory = {}
+        self.pending = set()
+        self.disk = None
+        self.lock = threading.Lock()
+
+    def get_disk(self):
+        if self.disk is None:
+            self.disk = JsonCache("markdown", MARKDOWN_CACHE_TTL)
+            self.disk.prune()
+        return self.disk
+
+    def get(self, key):
+        with self.lock:
+            value = self.memory.get(key)
+            if value is None:
+                blocks = self.get_disk().get(key)
+                if blocks is None:
+                    return None
+                value = self.memory[key] = json.dumps(blocks, ensure_ascii=False)
+        return json.loads(value)
+
+    def set(self, key, blocks):
+        with self.lock:
+            self.memory[key] = json.dumps(blocks, ensure_ascii=False)
+            self.pending.add(key)
+            if len(self.pending) < FLUSH_SIZE:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            values = {key: json.loads(self.memory[key]) for key in self.pending}
+            self.pending = set()
+            self.get_disk().update(values)
+
+
+# mistletoe的token列表是模块级的全局变量，解析时需要加锁
+parse_lock = threading.Lock()
+markdown_cache = MarkdownCache()
+atexit.register(markdown_cache.flush)
+
+
+def get_line_kind(line):
+    if not line.strip():
+        return "blank"
+    if QUOTE_MARKER_PATTERN.match(line):
+        return "quote"
+    if LIST_MARKER_PATTERN.match(line):
+        return "list"
+    if INDENTED_CODE_PATTERN.match(line):
+        return "code"
+    if BLOCK_START_PATTERN.match(line):
+        return "block"
+    return "paragraph"
+
+
+def split_segments(lines):
+    """
+    按照原来逐行解析的规则把Markdown分成几段，每一段单独交给mistletoe解析。
+    CommonMark中列表、引用和段落后面的行可能被当作上一项的延续（比如没有标记或者缩进的行），
+    原来逐行解析时这样的行是单独的块：列表和引用在没有标记的行结束，
+    段落后面缩进四个空格的行是代码块。代码块中的内容不处理。
+    """
+    segments = [[]]
+    container = None
+    fence = None
+    for line in lines:
+        if fence:
+            if line.lstrip().startswith(fence):
+                fence = None
+            segments[-1].append(line)
+            continue
+        match = FENCE_PATTERN.match(line)
+        if match:
+            fence = match.group(1)
+            # 列表项中缩进的代码块结束之后，列表仍然没有结束
+            if not (container == "list" and line[0] == " "):
+                container = None
+            segments[-1].append(line)
+            continue
+        kind = get_line_kind(line)
+        if kind == "blank":
+            # 空行之后缩进的行在CommonMark中仍然属于上一个列表项或者代码块
+            if container == "code" and segments[-1]:
+                segments.append([])
+            if container != "list":
+                container = None
+        else:
+            if container not in (None, "code", kind) and segments[-1]:
+                segments.append([])
+            container = kind if kind != "block" else None
+        segments[-1].append(line)
+    return segments
+
+
+def get_cache_key(markdown):
+    return hashlib.sha256(f"{RENDERER_VERSION}:{markdown}".encode("utf-8")).hexdigest()
+
+
+def convert(markdown):
+    """不使用缓存，直接把Markdown转换成Notion块"""
+    latex_blocks = []
+
+    def replace_latex_blocks(match):
+        latex_blocks.append(match.group(1).strip())
+        return f"LATEX_BLOCK_{len(latex_blocks) - 1}"
+
+    # 多行公式中可能有被当作列表或者标题的行，先替换成占位符
+    markdown = LATEX_BLOCK_PATTERN.sub(replace_latex_blocks, markdown)
+    blocks = []
+    with parse_lock:
+        with NotionRenderer(latex_blocks) as renderer:
+            for lines in split_segments(markdown.split("\n")):
+                document = block_token.Document([f"{line}\n" for line in lines])
+                blocks.extend(renderer.render(document))
+    return blocks
+
+
+def render_markdown(markdown):
+    """把Markdown转换成Notion块，内容相同时直接返回缓存的结果"""
+    key = get_cache_key(markdown)
+    blocks = markdown_cache.get(key)
+    if blocks is None:
+        blocks = convert(markdown)
+        markdown_cache.set(key, blocks)
+    return blocks
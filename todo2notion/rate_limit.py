@@ -0,0 +1,241 @@
+"""
+所有Notion请求共用的限流器。
+
+Notion的平均限制大约是每秒3个请求，超过之后返回429以及Retry-After。
+这里用令牌桶控制平均速率，被限流之后按照Retry-After暂停所有请求并降低并发，
+连续成功一段时间之后再逐步恢复并发。httpx（notion_client）和requests（文件上传）
+分别通过transport和adapter接入同一个限流器。
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import httpx
+from notion_client import APIErrorCode, APIResponseError
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+from requests.exceptions import ConnectionError, Timeout
+from retrying import retry
+
+from todo2notion.transport import PooledAdapter, create_async_transport, get_transport
+
+# 需要重试的状态码
+RETRY_STATUS_CODES = {409, 429, 500, 502, 503, 504}
+RETRY_ERROR_CODES = {
+    APIErrorCode.RateLimited,
+    APIErrorCode.ConflictError,
+    APIErrorCode.InternalServerError,
+    APIErrorCode.ServiceUnavailable,
+}
+
+
+class RateLimiter:
+    def __init__(self, rate=3.0, burst=3, max_concurrency=8, min_concurrency=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = max_concurrency
+        self.in_flight = 0
+        # Retry-After要求的暂停时间，对所有请求生效
+        self.blocked_until = 0
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def _try_acquire(self):
+        """尝试获取一个请求名额，返回需要等待的秒数，0表示获取成功"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= self.concurrency:
+                return 0.05
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, status_code=None, retry_after=None):
+        """请求结束之后根据结果调整并发"""
+        with self.lock:
+            self.in_flight -= 1
+            if status_code == 429:
+                self.successes = 0
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                if retry_after:
+                    self.blocked_until = max(
+                        self.blocked_until, time.monotonic() + retry_after
+                    )
+            elif status_code is not None and 200 <= status_code < 400:
+                # 网络错误没有状态码，不算作成功
+                self.successes += 1
+                if self.successes >= 20 and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self.successes = 0
+
+    def get_delay(self, attempt, retry_after=None):
+        """带抖动的指数退避，有Retry-After时至少等待Retry-After"""
+        delay = min(60, 2**attempt) * random.uniform(0.5, 1.0)
+        if retry_after:
+            delay = max(delay, retry_after + random.uniform(0, 1))
+        return delay
+
+
+def get_retry_after(headers):
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """notion_client使用的httpx transport，所有请求经过限流器并在429和5xx时重试"""
+
+    def __init__(self, transport=None, max_retries=5):
+        # 没有指定时使用共用的连接池，关闭client时不关闭共用的连接池
+        self.shared = transport is None
+        self.transport = transport or get_transport()
+        self.max_retries = max_retries
+
+    def handle_request(self, request):
+        attempt = 0
+        while True:
+            limiter.acquire()
+            response = None
+            status_code = None
+            retry_after = None
+            # 无论请求是否成功、是否被取消都要释放名额，否则并发降到1之后所有请求都会卡住
+            try:
+                response = self.transport.handle_request(request)
+                status_code = response.status_code
+                if status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    retry_after = get_retry_after(response.headers)
+                    response.close()
+                    response = None
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                limiter.release(status_code, retry_after)
+            if response is not None:
+                return response
+            time.sleep(limiter.get_delay(attempt, retry_after))
+            attempt += 1
+
+    def close(self):
+        if not self.shared:
+            self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """AsyncClient使用的httpx transport，和同步请求共用同一个限流器"""
+
+    def __init__(self, transport=None, max_retries=5):
+        self.transport = transport or create_async_transport()
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request):
+        attempt = 0
+        while True:
+            await limiter.acquire_async()
+            response = None
+            status_code = None
+            retry_after = None
+            try:
+                response = await self.transport.handle_async_request(request)
+                status_code = response.status_code
+                if status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    retry_after = get_retry_after(response.headers)
+                    await response.aclose()
+                    response = None
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                limiter.release(status_code, retry_after)
+            if response is not None:
+                return response
+            await asyncio.sleep(limiter.get_delay(attempt, retry_after))
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class RateLimitedAdapter(PooledAdapter):
+    """requests使用的adapter，用于文件上传"""
+
+    def __init__(self, max_retries=5, **kwargs):
+        self.retry_count = max_retries
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            limiter.acquire()
+            response = None
+            status_code = None
+            retry_after = None
+            try:
+                response = super().send(request, **kwargs)
+                status_code = response.status_code
+                if status_code in RETRY_STATUS_CODES and attempt < self.retry_count:
+                    retry_after = get_retry_after(response.headers)
+                    response.close()
+                    response = None
+            except (ConnectionError, Timeout):
+                if attempt >= self.retry_count:
+                    raise
+            finally:
+                limiter.release(status_code, retry_after)
+            if response is not None:
+                return response
+            time.sleep(limiter.get_delay(attempt, retry_after))
+            attempt += 1
+
+
+def is_retryable(exception):
+    """只有网络错误和Notion的临时错误需要重试，参数错误等直接抛出"""
+    if isinstance(exception, (httpx.TransportError, RequestTimeoutError)):
+        return True
+    if isinstance(exception, APIResponseError):
+        return exception.code in RETRY_ERROR_CODES
+    # 网关返回的错误不是Notion的json格式
+    return isinstance(exception, HTTPResponseError) and exception.status >= 500
+
+
+# 用于NotionHelper中的方法，transport已经处理了429，这里只处理重试次数用完之后的情况
+notion_retry = retry(
+    stop_max_attempt_number=3,
+    wait_exponential_multiplier=1000,
+    wait_exponential_max=30000,
+    retry_on_exception=is_retryable,
+)
+
+limiter = RateLimiter(
+    rate=float(os.getenv("NOTION_RATE_LIMIT", 3)),
+    max_concurrency=int(os.getenv("NOTION_MAX_CONCURRENCY", 8)),
+)
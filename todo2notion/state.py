@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+
+from todo2notion.config import CACHE_DIR
+
+
+class SyncState:
+    """本地同步状态，记录滴答清单的清单、任务以及笔记和Notion页面的对应关系"""
+
+    # 和Notion中的页面无关的记录，重建状态时保留
+    PERSISTENT_KINDS = ("attachment",)
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "state.db")
+        self.exists = os.path.exists(self.path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # 多线程同步时共用一个连接，通过锁保证同一时间只有一个线程访问
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                page_id TEXT,
+                modified_time,
+                fingerprint TEXT,
+                page TEXT,
+                PRIMARY KEY (kind, id)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+            self.conn.commit()
+
+    def is_stale(self, full=False, **database_ids):
+        """本地状态不存在、上次同步未完成或者database发生变化时需要全量重建"""
+        if not self.exists or full:
+            return True
+        if self.get_meta("last_sync_time") is None:
+            return True
+        for key, value in database_ids.items():
+            if self.get_meta(key) != value:
+                return True
+        return False
+
+    def load(self, kind):
+        """读取某一类型的所有记录，返回滴答清单id和Notion页面的映射"""
+        result = {}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, page FROM items WHERE kind = ?", (kind,)
+            ).fetchall()
+        for id, page in rows:
+            result[id] = json.loads(page) if page else None
+        return result
+
+    def get(self, kind, id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT page_id, modified_time, fingerprint FROM items WHERE kind = ? AND id = ?",
+                (kind, id),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"page_id": row[0], "modified_time": row[1], "fingerprint": row[2]}
+
+    def find(self, kind, fingerprint):
+        """查找fingerprint相同的记录，返回page_id列表"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT page_id FROM items WHERE kind = ? AND fingerprint = ?",
+                (kind, fingerprint),
+            ).fetchall()
+        return [x[0] for x in rows if x[0]]
+
+    def save(self, kind, id, page_id, modified_time=None, fingerprint=None, page=None):
+        """写入一条记录，fingerprint为空时保留原来的值"""
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT INTO items (kind, id, page_id, modified_time, fingerprint, page)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, id) DO UPDATE SET
+                    page_id = excluded.page_id,
+                    modified_time = excluded.modified_time,
+                    fingerprint = COALESCE(excluded.fingerprint, items.fingerprint),
+                    page = COALESCE(excluded.page, items.page)
+                """,
+                (
+                    kind,
+                    id,
+                    page_id,
+                    modified_time,
+                    fingerprint,
+                    json.dumps(page, ensure_ascii=False) if page is not None else None,
+                ),
+            )
+            self.conn.commit()
+
+    def delete(self, kind, id):
+        with self.lock:
+            self.conn.execute("DELETE FROM items WHERE kind = ? AND id = ?", (kind, id))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM items WHERE kind NOT IN (%s)"
+                % ",".join("?" * len(self.PERSISTENT_KINDS)),
+                self.PERSISTENT_KINDS,
+            )
+            self.conn.execute("DELETE FROM meta")
+            self.conn.commit()
+        self.exists = True
+
+    def close(self):
+        self.conn.close()
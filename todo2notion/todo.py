@@ -1,19 +1,42 @@
 #!/usr/bin/python
 # -*- coding: UTF-8 -*-
+import argparse
+import hashlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pendulum
 from retrying import retry
-from todo2notion.notion_helper import NotionHelper, TAG_ICON_URL
-import requests
 from dotenv import load_dotenv
-from todo2notion.upload import NotionFileUploader
+from todo2notion.lazy import LazyObject
+from todo2notion.state import SyncState
 
-from todo2notion import utils
+from todo2notion import block_diff, dates, utils
+from todo2notion.config import (
+    ATTACHMENT_WORKERS,
+    FULL_SYNC_DAYS,
+    LAST_EDITED_TIME_MARGIN,
+    TAG_ICON_URL,
+)
 
 load_dotenv()
 
+# 下载附件时每次写入的大小
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# 滴答清单中可能被清空，需要同步清空的属性
+CLEARABLE_PROPERTIES = (
+    "开始时间",
+    "结束时间",
+    "完成时间",
+    "进度",
+    "标签",
+    "星期",
+    "年",
+    "月",
+    "周",
+    "日",
+)
 
 headers = {
     "accept": "application/json, text/plain, */*",
@@ -46,20 +69,19 @@ def is_task_modified(item, todo_dict):
         last_modified_time = utils.get_property_value(
             todo.get("properties").get("最后修改时间")
         )
-        # 判断笔记是否需要同步
+        # 判断笔记是否需要同步，只有上次同步之后修改过的笔记需要比较修改时间
         j = utils.get_property_value(todo.get("properties").get("笔记最后修改时间"))
         notes = utils.get_property_value(todo.get("properties").get("笔记"))
         if notes:
             if j:
                 note_modification_dict = json.loads(j)
                 for note in notes:
-                    if note.get("id") not in note_modification_dict:
-                        print(note.get("id"))
+                    note_id = note.get("id")
+                    if note_id not in note_modification_dict:
                         return True
-                    note_page = notion_helper.client.pages.retrieve(note.get("id"))
-                    last_edited_time = note_page.get("last_edited_time")
-                    value = note_modification_dict.get(note.get("id"))
-                    if last_edited_time != value:
+                    if note_id in changed_note_ids and get_note_modified_time(
+                        note_id
+                    ) != note_modification_dict.get(note_id):
                         return True
             else:
                 return True
@@ -84,31 +106,37 @@ def is_project_modified(item, project_dict):
     return True
 
 
+def build_project(item):
+    """生成清单页面的属性和图标"""
+    emoji, title = utils.split_emoji_from_string(item.get("name"))
+    project = {
+        "标题": title,
+        "id": item.get("id"),
+        "最后修改时间": utils.parse_date(item.get("modifiedTime")),
+    }
+    icon = {"type": "emoji", "emoji": emoji}
+    # database结构刷新之后转换函数会重新生成，每次都从notion_helper获取
+    encoder = notion_helper.get_property_encoder(notion_helper.project_database_id)
+    return encoder(project), icon
+
+
 def get_projects(session, project_dict):
     """获取所有清单"""
     r = session.get("https://api.dida365.com/api/v2/projects", headers=headers)
     if r.ok:
-        # 获取映射关系
-        d = notion_helper.get_property_type(notion_helper.project_database_id)
         items = r.json()
         items = list(
             filter(lambda item: is_project_modified(item, project_dict), items)
         )
         for item in items:
-            emoji, title = utils.split_emoji_from_string(item.get("name"))
             id = item.get("id")
-            project = {
-                "标题": title,
-                "id": id,
-                "最后修改时间": utils.parse_date(item.get("modifiedTime")),
-            }
-            icon = {"type": "emoji", "emoji": emoji}
-            properties = utils.get_properties(project, d)
+            properties, icon = build_project(item)
             if id in project_dict:
-                notion_helper.update_page(
+                result = notion_helper.update_page(
                     page_id=project_dict.get(id).get("id"),
                     properties=properties,
                     icon=icon,
+                    database_id=notion_helper.project_database_id,
                 )
             else:
                 parent = {
@@ -118,7 +146,8 @@ def get_projects(session, project_dict):
                 result = notion_helper.create_page(
                     parent=parent, properties=properties, icon=icon
                 )
-                project_dict[id] = result
+            project_dict[id] = result
+            save_page("project", result)
     else:
         print(f" Get projects failed ${r.text}")
 
@@ -133,14 +162,51 @@ def remove_duplicates(data):
     return unique_data
 
 
-def get_all_completed(session):
-    """获取所有完成的任务"""
+def get_completed_start(full=False):
+    """获取已完成任务的开始时间，需要全量核对时返回空字符串"""
+    import pendulum
+
+    watermark = sync_state.get_meta("completed_watermark")
+    last_full_time = sync_state.get_meta("completed_full_sync_time")
+    if (
+        last_full_time is None
+        or pendulum.parse(last_full_time).add(days=FULL_SYNC_DAYS) < pendulum.now()
+    ):
+        full = True
+    if watermark and not full:
+        return pendulum.parse(watermark).format("YYYY-MM-DD HH:mm:ss"), full
+    print("全量获取已完成的任务")
+    return "", True
+
+
+def get_completed_meta(result, full, complete=True):
+    """同步完成之后需要保存的已完成任务水位，没有完整获取时保留原来的水位"""
+    meta = {}
+    if not complete:
+        # 任务按照完成时间倒序返回，中途失败时较早完成的任务还没有获取
+        return meta
+    completed_times = [x.get("completedTime") for x in result if x.get("completedTime")]
+    if completed_times:
+        meta["completed_watermark"] = max(completed_times, key=utils.parse_date)
+    if full:
+        import pendulum
+
+        meta["completed_full_sync_time"] = pendulum.now("UTC").to_iso8601_string()
+    return meta
+
+
+def get_all_completed(session, full=False):
+    """获取完成的任务，有水位时只获取上次同步之后新完成的任务"""
+    import pendulum
+
+    start, full = get_completed_start(full)
     date = pendulum.now()
     result = []
+    complete = True
     while True:
         to = date.format("YYYY-MM-DD HH:mm:ss")
         r = session.get(
-            f"https://api.dida365.com/api/v2/project/all/completedInAll/?from=&to={to}&limit=100",
+            f"https://api.dida365.com/api/v2/project/all/completedInAll/?from={start}&to={to}&limit=100",
             headers=headers,
         )
         if r.ok:
@@ -153,163 +219,451 @@ def get_all_completed(session):
                 break
         else:
             print(f"获取任务失败 {r.text}")
+            complete = False
+            break
     result = remove_duplicates(result)
-    return result
+    return result, get_completed_meta(result, full, complete)
+
+
+def batch_check(session, check_point):
+    """调用batch/check接口，checkPoint为0时返回全部未完成的任务"""
+    r = session.get(
+        f"https://api.dida365.com/api/v2/batch/check/{check_point}", headers=headers
+    )
+    if r.ok and r.json().get("syncTaskBean") is not None:
+        return r.json()
+    print(f"获取任务失败 {r.text}")
+    return None
 
 
 def get_all_task(session):
-    """获取所有未完成的任务"""
-    r = session.get("https://api.dida365.com/api/v2/batch/check/0", headers=headers)
+    """获取未完成的任务，有checkPoint时只获取上次同步之后的增量数据"""
+    check_point = sync_state.get_meta("check_point", "0")
+    result = batch_check(session, check_point)
+    if result is None and check_point != "0":
+        print(f"checkPoint {check_point} 已失效，重新获取全部任务")
+        check_point = "0"
+        result = batch_check(session, check_point)
+    return parse_batch_check(result, check_point)
+
+
+def parse_batch_check(result, check_point):
+    """解析batch/check的结果，返回更新的任务、删除的任务id以及新的checkPoint"""
+    if result is None:
+        return [], [], check_point
+    sync_task_bean = result.get("syncTaskBean")
     results = []
-    if r.ok:
-        results.extend(r.json().get("syncTaskBean").get("update"))
-    else:
-        print(f"获取任务失败 {r.text}")
-    return results
-
+    results.extend(sync_task_bean.get("update") or [])
+    results.extend(sync_task_bean.get("add") or [])
+    deleted_ids = [
+        x.get("taskId") if isinstance(x, dict) else x
+        for x in sync_task_bean.get("delete") or []
+    ]
+    return results, deleted_ids, str(result.get("checkPoint", check_point))
+
+
+def get_task(session, full=False):
+    """获取所有任务，返回任务、已删除的任务id以及同步完成后需要保存的进度"""
+    results, meta = get_all_completed(session, full)
+    tasks, deleted_ids, check_point = get_all_task(session)
+    # 上次同步之后完成的任务可能同时出现在两个接口中，保留已完成的记录
+    results = remove_duplicates(results + tasks)
+    meta["check_point"] = check_point
+    return results, deleted_ids, meta
+
+
+def delete_task_from_notion(deleted_ids, todo_dict):
+    """删除在滴答清单中已经删除的任务"""
+    for id in deleted_ids:
+        todo = todo_dict.pop(id, None)
+        if todo is None:
+            continue
+        try:
+            notion_helper.delete_block(todo.get("id"))
+        except Exception as e:
+            print(f"删除任务失败 {id}: {e}")
+        sync_state.delete("task", id)
+
+
+def get_changed_properties(properties, page):
+    """和Notion页面中已有的属性比较，只返回发生变化的属性"""
+    old_properties = page.get("properties")
+    changed = {
+        key: value
+        for key, value in properties.items()
+        if not utils.is_property_equal(value, old_properties.get(key))
+    }
+    # 滴答清单中被清空的字段在Notion中也需要清空
+    for key in CLEARABLE_PROPERTIES:
+        old_property = old_properties.get(key)
+        if key in properties or old_property is None:
+            continue
+        if utils.normalize_property(old_property) in (None, "", [], [None, None]):
+            continue
+        empty = utils.get_empty_property(old_property.get("type"))
+        if empty is not None:
+            changed[key] = empty
+    return changed
+
+
+def is_page_missing(e):
+    """页面在Notion中已经被删除"""
+    from notion_client import APIErrorCode, APIResponseError
+
+    return isinstance(e, APIResponseError) and (
+        e.code == APIErrorCode.ObjectNotFound or "archived" in str(e)
+    )
+
+
+def create_task_page(item, parent, properties, icon, notes, fingerprint, session):
+    """创建任务页面，第一批块随页面一起创建，剩下的块打包追加"""
+    from notion_client import APIErrorCode, APIResponseError
 
-def get_task(session):
-    """获取所有清单"""
-    results = get_all_completed(session)
-    results.extend(get_all_task(session))
-    return results
+    id = item.get("id")
+    chunks = []
+    try:
+        blocks = []
+        if item.get("content"):
+            blocks = convert_to_block(id, item.get("projectId"), item.get("content"), None, session)
+        for note in notes:
+            blocks.extend(notion_helper.get_block_children(note.get("id")))
+        chunks = notion_helper.pack_blocks(blocks)
+    except Exception as e:
+        print(f"生成块时发生异常: {e}")
+        fingerprint = None
+    first_chunk = chunks.pop(0) if chunks else []
+    try:
+        result = notion_helper.create_page(
+            parent=parent,
+            properties=properties,
+            icon=icon,
+            children=[x[0] for x in first_chunk],
+        )
+    except APIResponseError as e:
+        if not first_chunk or e.code != APIErrorCode.ValidationError:
+            raise
+        # 第一批块中有Notion不接受的块，先创建空页面，再逐批追加并跳过出错的块
+        print(f"追加块时发生异常: {e}")
+        result = notion_helper.create_page(parent=parent, properties=properties, icon=icon)
+        chunks.insert(0, first_chunk)
+        first_chunk = []
+    try:
+        if any(x[1] or x[2] for x in first_chunk):
+            ids = [x.get("id") for x in notion_helper.get_block_children(result.get("id"))]
+            notion_helper.append_deferred_blocks(ids, first_chunk)
+        notion_helper.append_packed_blocks(result.get("id"), chunks)
+    except Exception as e:
+        print(f"追加块时发生异常: {e}")
+        fingerprint = None
+    return result, fingerprint
+
+
+def update_page_content(page_id, blocks, session, project_id, id):
+    """对比页面中已有的块，只修改发生变化的块"""
+    old_blocks = notion_helper.get_block_tree(page_id)
+    for operation in block_diff.diff_blocks(blocks, old_blocks, page_id):
+        if operation.get("op") == "delete":
+            notion_helper.delete_block(operation.get("block_id"))
+        elif operation.get("op") == "update":
+            notion_helper.update_block(operation.get("block_id"), operation.get("block"))
+        elif operation.get("op") == "insert":
+            children = operation.get("blocks")
+            upload_image(children, session, project_id, id, page_id)
+            notion_helper.append_block_tree(
+                operation.get("parent_id"), children, operation.get("after")
+            )
 
 
-def add_task_to_notion(items, project_dict, todo_dict, config,session, page_id=None):
-    d = notion_helper.get_property_type(notion_helper.todo_database_id)
+def add_task_to_notion(items, project_dict, todo_dict, config,session, page_id=None, workers=1):
     items = list(filter(lambda item: is_task_modified(item, todo_dict), items))
-    for index, item in enumerate(items):
-        id = item.get("id")
-        task = {"标题": item.get("title"), "id": id, "状态": "Not started"}
-        if page_id:
-            task["Parent task"] = [page_id]
-        if item.get("projectId") and item.get("projectId") in project_dict:
-            task["清单"] = [project_dict.get(item.get("projectId")).get("id")]
-        if item.get("startDate"):
-            task["开始时间"] = utils.parse_date(item.get("startDate"))
-            task["time"] = item.get("startDate")
-        if item.get("dueDate"):
-            task["结束时间"] = utils.parse_date(item.get("dueDate"))
-        if item.get("modifiedTime"):
-            task["最后修改时间"] = utils.parse_date(item.get("modifiedTime"))
-        if item.get("progress"):
-            task["进度"] = item.get("progress") / 100
-        persons = [
-            x
-            for x in notion_helper.client.users.list().get("results")
-            if x.get("type") == "person"
-        ]
-        if persons:
-            task["Assignee"] = persons
-        if item.get("tags"):
-            task["标签"] = [
-                notion_helper.get_relation_id(
-                    x, notion_helper.tag_database_id, TAG_ICON_URL
+    if workers > 1 and len(items) > 1:
+        # 任务之间互相独立，清单在这之前已经同步，子任务在父任务所在的线程中同步
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    sync_task, item, project_dict, todo_dict, config, session, page_id
                 )
-                for x in item.get("tags")
+                for item in items
             ]
-        parent = {
-            "database_id": notion_helper.todo_database_id,
-            "type": "database_id",
-        }
-        icon = "https://www.notion.so/icons/circle_outline_green.svg"
-        properties = {}
-        if item.get("completedTime"):
-            task["状态"] = "Done"
-            task["完成时间"] = utils.parse_date(item.get("completedTime"))
-            task["time"] = item.get("completedTime")
-            icon = "https://www.notion.so/icons/checkmark_circle_green.svg"
-        blocks = []
-        if id in todo_dict:
-            notes = utils.get_property_value(
+            for future in as_completed(futures):
+                future.result()
+    else:
+        for item in items:
+            sync_task(item, project_dict, todo_dict, config, session, page_id)
+
+
+def get_task_date(item):
+    """任务对应的日期，已完成的任务使用完成时间，否则使用开始时间"""
+    time = item.get("completedTime") or item.get("startDate")
+    if time is None:
+        return None
+    return dates.parse(time)
+
+
+def build_task(item, project_dict, todo_dict, page_id=None):
+    """生成任务页面的属性、图标、关联的笔记以及内容指纹"""
+    id = item.get("id")
+    task = {"标题": item.get("title"), "id": id, "状态": "Not started"}
+    if page_id:
+        task["Parent task"] = [page_id]
+    if item.get("projectId") and item.get("projectId") in project_dict:
+        task["清单"] = [project_dict.get(item.get("projectId")).get("id")]
+    if item.get("startDate"):
+        task["开始时间"] = utils.parse_date(item.get("startDate"))
+    if item.get("dueDate"):
+        task["结束时间"] = utils.parse_date(item.get("dueDate"))
+    if item.get("modifiedTime"):
+        task["最后修改时间"] = utils.parse_date(item.get("modifiedTime"))
+    if item.get("progress"):
+        task["进度"] = item.get("progress") / 100
+    persons = notion_helper.get_persons()
+    if persons:
+        task["Assignee"] = persons
+    if item.get("tags"):
+        task["标签"] = [
+            notion_helper.get_relation_id(
+                x, notion_helper.tag_database_id, TAG_ICON_URL
+            )
+            for x in item.get("tags")
+        ]
+    icon = "https://www.notion.so/icons/circle_outline_green.svg"
+    if item.get("completedTime"):
+        task["状态"] = "Done"
+        task["完成时间"] = utils.parse_date(item.get("completedTime"))
+        icon = "https://www.notion.so/icons/checkmark_circle_green.svg"
+    notes = []
+    note_modification_dict = {}
+    if id in todo_dict:
+        notes = (
+            utils.get_property_value(
                 todo_dict.get(id).get("properties").get("笔记")
             )
-            if notes:
-                task["笔记"] = [x.get("id") for x in notes]
-                note_modification_dict = {}
-                for i in notes:
-                    note_page = notion_helper.client.pages.retrieve(i.get("id"))
-                    last_edited_time = note_page.get("last_edited_time")
-                    note_modification_dict[i.get("id")] = last_edited_time
-                task["笔记最后修改时间"] = json.dumps(
-                    note_modification_dict, ensure_ascii=False
+            or []
+        )
+        if notes:
+            task["笔记"] = [x.get("id") for x in notes]
+            for i in notes:
+                note_modification_dict[i.get("id")] = get_note_modified_time(
+                    i.get("id")
                 )
+            task["笔记最后修改时间"] = json.dumps(
+                note_modification_dict, ensure_ascii=False
+            )
+    properties = {}
+    notion_helper.get_all_relation(properties)
+    date = get_task_date(item)
+    if date:
+        task["星期"] = date.weekday
+        notion_helper.get_date_relation(properties, date)
+    encoder = notion_helper.get_property_encoder(notion_helper.todo_database_id)
+    properties.update(encoder(task))
+    fingerprint = utils.get_fingerprint(item.get("content"), note_modification_dict)
+    return properties, icon, notes, fingerprint
+
+
+def sync_task(item, project_dict, todo_dict, config, session, page_id=None):
+    """同步一个任务以及它的子任务"""
+    from notion_client import APIResponseError
 
-            for note in notes:
-                blocks.extend(notion_helper.get_block_children(note.get("id")))
-            notion_helper.delete_block(todo_dict.get(id).get("id"))
-        properties = {}
-        notion_helper.get_all_relation(properties)
-        if task.get("time"):
-            chinese_weekdays = [
-                "星期一",
-                "星期二",
-                "星期三",
-                "星期四",
-                "星期五",
-                "星期六",
-                "星期日",
-            ]
-            date = pendulum.parse(task.get("time"))
-            date = date.in_timezone("Asia/Shanghai")
-            chinese_day_of_week = chinese_weekdays[date.day_of_week]
-            task["星期"] = chinese_day_of_week
-            notion_helper.get_date_relation(properties, date)
-        properties.update(utils.get_properties(task, d))
-        result = notion_helper.create_page(
-            parent=parent, properties=properties, icon=utils.get_icon(icon)
+    id = item.get("id")
+    try:
+        result, fingerprint = write_task(item, project_dict, todo_dict, session, page_id)
+    except APIResponseError as e:
+        # 关联的标签或者日期页面已经被删除，清除缓存之后重新生成属性
+        if not notion_helper.evict_stale_relations(e):
+            raise
+        print(f"关联的页面已经失效，重新获取 {id}")
+        result, fingerprint = write_task(item, project_dict, todo_dict, session, page_id)
+    todo_dict[id] = result
+    save_page("task", result, fingerprint)
+    if item.get("items"):
+        add_task_to_notion(item.get("items"),project_dict, todo_dict, config, session, result.get("id"))
+
+
+def write_task(item, project_dict, todo_dict, session, page_id=None):
+    """更新或者创建任务页面，返回页面和内容指纹"""
+    id = item.get("id")
+    properties, icon, notes, fingerprint = build_task(
+        item, project_dict, todo_dict, page_id
+    )
+    parent = {
+        "database_id": notion_helper.todo_database_id,
+        "type": "database_id",
+    }
+    result = None
+    if id in todo_dict:
+        # 已经同步过的任务只更新发生变化的属性，保留原来的页面
+        page = todo_dict.get(id)
+        changed = get_changed_properties(properties, page)
+        new_icon = None
+        if (page.get("icon") or {}).get("external", {}).get("url") != icon:
+            new_icon = utils.get_icon(icon)
+        try:
+            if changed or new_icon:
+                result = notion_helper.update_page(
+                    page_id=page.get("id"),
+                    properties=changed,
+                    icon=new_icon,
+                    database_id=notion_helper.todo_database_id,
+                )
+            else:
+                result = page
+        except Exception as e:
+            if not is_page_missing(e) or notion_helper.get_stale_relation_keys(e):
+                raise
+            print(f"页面已经被删除，重新创建 {id}")
+    record = sync_state.get("task", id)
+    if result is None:
+        result, fingerprint = create_task_page(
+            item, parent, properties, utils.get_icon(icon), notes, fingerprint, session
         )
-        todo_dict[id] = result
+    elif record is None or record.get("fingerprint") != fingerprint:
+        # 内容或者笔记发生变化时才修改页面内容
         try:
+            blocks = []
             if item.get("content"):
-                blocks = (
-                    convert_to_block(id, item.get("projectId"), item.get("content"), result.get("id"), session)
-                    + blocks
-                )
-            if blocks:
-                append_block(result.get("id"), blocks)
+                blocks = utils.parse_md(item.get("content"))
+            for note in notes:
+                blocks.extend(notion_helper.get_block_children(note.get("id")))
+            update_page_content(
+                result.get("id"), blocks, session, item.get("projectId"), id
+            )
         except Exception as e:
             print(f"追加块时发生异常: {e}")
-        if item.get("items"):
-            add_task_to_notion(item.get("items"),project_dict, todo_dict, config, result.get("id"),session)
+            fingerprint = None
+    else:
+        fingerprint = None
+    return result, fingerprint
+
 
 @retry(stop_max_attempt_number=3, wait_fixed=5000)
 def download_file_with_retry(url, session, headers, file_path, max_retries=3):
-    response = session.get(url, headers=headers)
-    if response.status_code == 200:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)  # 创建目录
-        with open(file_path, "wb") as file:
-            file.write(response.content)
-        return True
-    else:
-        print(f"文件下载失败，状态码: {response.status_code}")
+    """
+    流式下载到file_path.part，边下载边计算sha256，完成之后重命名为file_path。
+    下载中断时保留.part文件，重试时通过Range从中断的位置继续下载。
+    返回文件的sha256，下载失败时返回None。
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)  # 创建目录
+    tmp_path = f"{file_path}.part"
+    request_headers = dict(headers)
+    if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+        request_headers["Range"] = f"bytes={os.path.getsize(tmp_path)}-"
+    with session.get(url, headers=request_headers, stream=True) as response:
+        if response.status_code not in (200, 206):
+            if "Range" in request_headers:
+                # 已经下载的部分可能失效了，下次从头下载
+                os.remove(tmp_path)
+                raise IOError(f"断点续传失败，状态码: {response.status_code}")
+            print(f"文件下载失败，状态码: {response.status_code}")
+            return None
+        offset = utils.get_range_offset(tmp_path, response.status_code, response.headers)
+        if offset is None:
+            os.remove(tmp_path)
+            raise IOError(f"断点续传的位置不正确: {response.headers.get('Content-Range')}")
+        sha256 = hashlib.sha256()
+        if offset:
+            utils.update_file_hash(sha256, tmp_path)
+        with open(tmp_path, "ab" if offset else "wb") as file:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                sha256.update(chunk)
+    os.replace(tmp_path, file_path)
+    return sha256.hexdigest()
+
+
+def get_cached_attachment(url, file_path):
+    """
+    附件按照滴答清单中的路径记录本地文件的sha256和上传到Notion的file_upload id。
+    本地文件存在并且内容没有变化时返回sha256，不需要重新下载。
+    """
+    record = sync_state.get("attachment", url)
+    if record is None or not os.path.exists(file_path):
+        return None
+    file_hash = utils.get_file_hash(file_path)
+    if file_hash != record.get("fingerprint"):
+        return None
+    return file_hash
+
+
+def upload_attachment(url, file_path, file_hash, parent_id):
+    """内容相同的文件之前上传过并且还可以使用时直接复用，否则重新上传"""
+    file_upload_id = None
+    for x in sync_state.find("attachment", file_hash):
+        if uploader.is_file_upload_reusable(uploader.get_file_upload(x)):
+            file_upload_id = x
+            break
+    if file_upload_id is None:
+        file_upload_id = uploader.upload_file(file_path, parent_id)
+    if file_upload_id:
+        sync_state.save("attachment", url, file_upload_id, fingerprint=file_hash)
+    return file_upload_id
+
+
+def collect_image_blocks(blocks, result=None):
+    """递归收集所有需要上传的图片块，返回所在的列表和图片块"""
+    if result is None:
+        result = []
+    for block in blocks:
+        if block is None:
+            continue
+        if block.get("type") == "image" and "external" in block.get("image"):
+            result.append((blocks, block))
+        children = block_diff.get_children(block)
+        if children:
+            collect_image_blocks(children, result)
+    return result
+
+
+def replace_image_blocks(images, results):
+    """把上传成功的图片块改成file_upload，移除失败的图片块"""
+    failed = set()
+    for (container, block), file_upload_id in zip(images, results):
+        if file_upload_id:
+            block["image"].pop("external")
+            block["image"]["type"] = "file_upload"
+            block["image"]["file_upload"] = {"id": file_upload_id}
+        else:
+            failed.add(id(block))
+    for container in {id(x[0]): x[0] for x in images}.values():
+        container[:] = [x for x in container if id(x) not in failed]
+
+
+def transfer_image(block, session, project_id, id, parent_id):
+    """下载一个图片并上传到Notion，返回file_upload的id，失败时返回None"""
+    url = block.get("image").get("external").get("url")
+    dir, file_name = url.split("/")[:2]
+    download_url = f"https://api.dida365.com/api/v1/attachment/{project_id}/{id}/{dir}?action=download"
+    file_path = os.path.join("images", dir, file_name)  # 组合完整文件路径
+    try:
+        file_hash = get_cached_attachment(url, file_path)
+        if file_hash is None:
+            file_hash = download_file_with_retry(download_url, session, headers, file_path)
+            if file_hash is None:
+                return None
+        file_upload_id = upload_attachment(url, file_path, file_hash, parent_id)
+    except Exception as e:
+        print(f"上传图片失败 {url}: {e}")
+        return None
+    print(f"uploader result = {file_upload_id}")
+    return file_upload_id
 
 
 def upload_image(blocks, session, project_id, id, parent_id):
-    for block in blocks:
-        if block is not None and block.get("type") == "image":
-            url = block.get("image").get("external").get("url")
-            urls = url.split("/")
-            dir = urls[0]
-            file_name = urls[1]
-            download_url = f"https://api.dida365.com/api/v1/attachment/{project_id}/{id}/{dir}?action=download"
-            file_path = os.path.join("images", dir, file_name)  # 组合完整文件路径
-            success = download_file_with_retry(download_url, session, headers, file_path)
-            if success:
-                file_upload_id = uploader.upload_file(file_path, parent_id)
-                if file_upload_id:
-                    print(f"uploader result = {file_upload_id}")
-                    block["image"]["type"] = "file_upload"
-                    block["image"].pop("external")
-                    block["image"]["file_upload"] = {"id": file_upload_id}
-                else:
-                    blocks.remove(block)
-            else:
-                # 如果下载失败，则从blocks中移除当前block
-                blocks.remove(block)
-            if block.get("children"):
-                upload_image(block.get("children"), session, project_id, id, parent_id)
-uploader = NotionFileUploader()
+    """并行下载和上传所有图片（包括子块中的图片），全部完成之后统一替换图片块"""
+    images = collect_image_blocks(blocks)
+    if not images:
+        return blocks
+    with ThreadPoolExecutor(max_workers=ATTACHMENT_WORKERS) as executor:
+        results = list(
+            executor.map(
+                lambda x: transfer_image(x[1], session, project_id, id, parent_id),
+                images,
+            )
+        )
+    replace_image_blocks(images, results)
+    return blocks
+
+
 def convert_to_block(id, project_id, content, parent_id,session):
     blocks = utils.parse_md(content)
     upload_image(blocks,session,project_id,id,parent_id)
@@ -317,24 +671,10 @@ def convert_to_block(id, project_id, content, parent_id,session):
 
 
 
-def append_block(block_id, blocks):
-    for block in blocks:
-        children = None
-        if block.get("children"):
-            children = block.pop("children")
-        id = (
-            notion_helper.client.blocks.children.append(
-                block_id=block_id, children=[block]
-            )
-            .get("results")[0]
-            .get("id")
-        )
-        if children:
-            append_block(id, children)
-
-
 def login(username, password):
-    session = requests.Session()
+    from todo2notion import transport
+
+    session = transport.create_session()
     login_url = "https://api.dida365.com/api/v2/user/signon?wc=true&remember=true"
     payload = {"username": username, "password": password}
     response = session.post(login_url, json=payload, headers=headers)
@@ -347,29 +687,169 @@ def login(username, password):
         return None
 
 
+def save_page(kind, page, fingerprint=None):
+    """把Notion页面记录到本地状态中"""
+    properties = page.get("properties")
+    id = utils.get_property_value(properties.get("id"))
+    if not id:
+        return
+    modified_time = None
+    if properties.get("最后修改时间"):
+        modified_time = utils.get_property_value(properties.get("最后修改时间"))
+    sync_state.save(
+        kind,
+        id,
+        page.get("id"),
+        modified_time=modified_time,
+        fingerprint=fingerprint,
+        page=page,
+    )
+
+
+def get_note_modified_time(id):
+    """从本地状态读取笔记的最后修改时间，本地没有记录时才请求Notion"""
+    note = sync_state.get("note", id)
+    if note and note.get("modified_time"):
+        return note.get("modified_time")
+    last_edited_time = notion_helper.client.pages.retrieve(id).get("last_edited_time")
+    sync_state.save("note", id, id, modified_time=last_edited_time)
+    return last_edited_time
+
+
+def get_last_edited_filter(last_sync_time):
+    """查询上次同步之后修改过的页面，last_edited_time只精确到分钟，需要向前多查询一段时间"""
+    import pendulum
+
+    since = pendulum.parse(last_sync_time).subtract(seconds=LAST_EDITED_TIME_MARGIN)
+    return {
+        "timestamp": "last_edited_time",
+        "last_edited_time": {"on_or_after": since.to_iso8601_string()},
+    }
+
+
+def load_notes(last_sync_time=None):
+    """一次分页查询笔记database中上次同步之后修改过的笔记，记录到changed_note_ids中"""
+    changed_note_ids.clear()
+    if not notion_helper.note_database_id:
+        return changed_note_ids
+    filter = None
+    if last_sync_time:
+        filter = get_last_edited_filter(last_sync_time)
+    for page in notion_helper.query_all(notion_helper.note_database_id, filter=filter):
+        sync_state.save(
+            "note", page.get("id"), page.get("id"), modified_time=page.get("last_edited_time")
+        )
+        changed_note_ids.add(page.get("id"))
+    return changed_note_ids
+
+
+def load_state(full=False):
+    """读取本地状态，状态不存在或者已过期时从Notion全量重建"""
+    database_dict = {
+        "project": notion_helper.project_database_id,
+        "task": notion_helper.todo_database_id,
+    }
+    database_ids = {f"{kind}_database_id": id for kind, id in database_dict.items()}
+    if sync_state.is_stale(full, **database_ids):
+        print("本地状态不存在或已过期，从Notion重建")
+        sync_state.clear()
+        for kind, database_id in database_dict.items():
+            for page in notion_helper.query_all(database_id):
+                save_page(kind, page)
+        for key, value in database_ids.items():
+            sync_state.set_meta(key, value)
+    else:
+        # 只获取上次同步之后在Notion中修改过的页面，比如新关联的笔记
+        filter = get_last_edited_filter(sync_state.get_meta("last_sync_time"))
+        for kind, database_id in database_dict.items():
+            for page in notion_helper.query_all(database_id, filter=filter):
+                save_page(kind, page)
+    load_notes(sync_state.get_meta("last_sync_time"))
+    return sync_state.load("project"), sync_state.load("task")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="同步滴答清单到Notion")
+    parser.add_argument(
+        "--full", action="store_true", help="忽略本地状态，全量同步所有任务"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WORKERS", 1)),
+        help="同时同步的任务数量，默认为1",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="使用asyncio同步，Notion和滴答清单的请求在同一个事件循环中并发执行",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("ASYNC_CONCURRENCY", 10)),
+        help="使用asyncio同步时同时进行的请求数量，默认为10",
+    )
+    parser.add_argument(
+        "--calendar",
+        metavar="START-END",
+        help="创建年份范围内所有缺少的年、月、周、日页面，比如2024-2026，创建完成后退出",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    notion_helper.load_relation_index()
+    if args.calendar:
+        start, _, end = args.calendar.partition("-")
+        notion_helper.create_calendar_pages(
+            int(start), int(end or start), workers=args.workers
+        )
+        return
+    if args.use_async:
+        from todo2notion import async_todo
+
+        async_todo.main(args)
+        return
     config = notion_helper.config
     username = config.get("滴答清单账号")
     password = config.get("滴答清单密码")
     print(username)
     print(password)
     session = login(username, password)
-    projects = notion_helper.query_all(notion_helper.project_database_id)
-    project_dict = {}
-    for item in projects:
-        project_dict[utils.get_property_value(item.get("properties").get("id"))] = item
+    import pendulum
+
+    sync_time = pendulum.now("UTC").to_iso8601_string()
+    full = args.full or bool(os.getenv("FULL_SYNC"))
+    project_dict, todo_dict = load_state(full)
     get_projects(session, project_dict)
-    todos = notion_helper.query_all(notion_helper.todo_database_id)
-    # print(len(todos))
-    # for todo in todos:
-    #     notion_helper.delete_block(todo.get("id"))
-    todo_dict = {}
-    for todo in todos:
-        todo_dict[utils.get_property_value(todo.get("properties").get("id"))] = todo
-    tasks = get_task(session)
-    add_task_to_notion(tasks,project_dict,todo_dict,config,session)
-
-
-notion_helper = NotionHelper()
+    tasks, deleted_ids, meta = get_task(session, full)
+    add_task_to_notion(tasks,project_dict,todo_dict,config,session, workers=args.workers)
+    delete_task_from_notion(deleted_ids, todo_dict)
+    for key, value in meta.items():
+        sync_state.set_meta(key, value)
+    sync_state.set_meta("last_sync_time", sync_time)
+
+
+def create_notion_helper():
+    from todo2notion.notion_helper import NotionHelper
+
+    return NotionHelper()
+
+
+def create_uploader():
+    from todo2notion.upload import NotionFileUploader
+
+    return NotionFileUploader()
+
+
+# 第一次使用时才创建，导入模块或者--help时不会请求Notion
+notion_helper = LazyObject(create_notion_helper)
+uploader = LazyObject(create_uploader)
+sync_state = LazyObject(SyncState)
+# 上次同步之后修改过的笔记
+changed_note_ids = set()
 if __name__ == "__main__":
     main()
@@ -0,0 +1,104 @@
+"""
+所有HTTP请求共用的连接配置：keep-alive连接池、连接数、超时以及可选的HTTP/2。
+notion_client和asyncio版本使用httpx，滴答清单、文件上传和图片下载使用requests，
+两边都从这里创建，修改环境变量就可以统一调整。
+"""
+import os
+import threading
+from importlib.util import find_spec
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# 读取响应的超时时间（秒）
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 60))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+# 所有host加起来的最大连接数
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 32))
+# 保留的空闲连接数。httpx没有每个host的限制，这是所有host加起来的数量；
+# requests（urllib3）的连接池按照host划分，这是每个host的连接池大小。
+# HTTP_MAX_CONNECTIONS_PER_HOST是原来的名称，仍然可以使用
+MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv(
+        "HTTP_MAX_KEEPALIVE_CONNECTIONS",
+        os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 8),
+    )
+)
+# 空闲连接保留的时间（秒）
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+# 安装了h2时httpx使用HTTP/2，设置HTTP2=0关闭
+HTTP2 = os.getenv("HTTP2", "1") != "0" and find_spec("h2") is not None
+
+_lock = threading.Lock()
+_transport = None
+_adapter = None
+_session = None
+
+
+def get_timeout():
+    """连接和读取分别设置超时，notion_client的timeout_ms只能设置一个总的超时"""
+    return httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def get_limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def get_transport():
+    """进程内共用的httpx连接池"""
+    global _transport
+    with _lock:
+        if _transport is None:
+            _transport = httpx.HTTPTransport(http2=HTTP2, limits=get_limits())
+        return _transport
+
+
+def create_async_transport():
+    """httpx的异步连接池和事件循环绑定，每个AsyncClient单独创建"""
+    return httpx.AsyncHTTPTransport(http2=HTTP2, limits=get_limits())
+
+
+class PooledAdapter(HTTPAdapter):
+    """requests的连接池adapter，请求没有指定超时时使用默认超时"""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout or (CONNECT_TIMEOUT, TIMEOUT)
+        kwargs.setdefault("pool_connections", MAX_CONNECTIONS // MAX_KEEPALIVE_CONNECTIONS or 1)
+        kwargs.setdefault("pool_maxsize", MAX_KEEPALIVE_CONNECTIONS)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_adapter():
+    """进程内共用的requests连接池"""
+    global _adapter
+    with _lock:
+        if _adapter is None:
+            _adapter = PooledAdapter()
+        return _adapter
+
+
+def create_session(adapter=None):
+    """创建使用共用连接池的requests.Session，cookie等状态每个session单独保存"""
+    session = requests.Session()
+    adapter = adapter or get_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """没有状态的请求（比如下载图片）共用的session"""
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
@@ -1,5 +1,5 @@
 import os
-from todo2notion.notion_helper import NotionHelper
+from todo2notion.lazy import LazyObject
 
 
 def get_file(dir):
@@ -23,6 +23,12 @@ def main():
         if block_id:
             notion_helper.update_heatmap(block_id=block_id, url=heatmap_url)
 
-notion_helper = NotionHelper()
+def create_notion_helper():
+    from todo2notion.notion_helper import NotionHelper
+
+    return NotionHelper()
+
+
+notion_helper = LazyObject(create_notion_helper)
 if __name__ == "__main__":
     main()
@@ -1,9 +1,17 @@
 import requests
 import os
 import mimetypes
+import mmap
+import time
 import json # 用于美化打印JSON
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
+from todo2notion import transport
+from todo2notion.config import UPLOAD_WORKERS
+from todo2notion.rate_limit import RateLimitedAdapter
+
 # 确保加载 .env 文件中的环境变量
 load_dotenv()
 
@@ -15,14 +23,17 @@ class NotionFileUploader:
     """
 
     MAX_SINGLE_PART_UPLOAD_SIZE = 20 * 1024 * 1024 # 20 MB
+    CHUNK_SIZE = 5 * 1024 * 1024 # 多部分上传的分块大小
+    MAX_PART_RETRIES = 3 # 单个分块失败时的重试次数
 
-    def __init__(self, notion_token: str = None, notion_version: str = "2022-06-28"):
+    def __init__(self, notion_token: str = None, notion_version: str = "2022-06-28", upload_workers: int = UPLOAD_WORKERS):
         """
         初始化 NotionFileUploader 实例。
 
         Args:
             notion_token (str): 你的 Notion 集成令牌。
             notion_version (str): Notion API 版本。默认为 "2022-06-28"。
+            upload_workers (int): 多部分上传时同时发送的分块数量。
         """
         # 如果未通过参数传入，则从环境变量获取 NOTION_TOKEN
         self.notion_token = notion_token if notion_token else os.getenv("NOTION_TOKEN")
@@ -34,6 +45,13 @@ class NotionFileUploader:
             "Content-Type": "application/json" # 默认设置 Content-Type
         }
         self.base_url = "https://api.notion.com/v1"
+        self.upload_workers = max(1, upload_workers)
+        # 所有请求复用同一个连接池，并且和其他Notion请求共用同一个限流器
+        self.session = transport.create_session()
+        self.session.mount(
+            self.base_url,
+            RateLimitedAdapter(pool_connections=1, pool_maxsize=self.upload_workers),
+        )
 
     def upload_file(self, file_path: str, parent_id: str, parent_type: str = "page_id"):
         """
@@ -73,6 +91,35 @@ class NotionFileUploader:
         return file_upload_id
 
 
+    def get_file_upload(self, file_upload_id: str):
+        """
+        获取文件上传对象，失败时返回 None。
+        """
+        try:
+            response = self.session.get(
+                f"{self.base_url}/file_uploads/{file_upload_id}", headers=self.headers
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"获取文件上传对象时出错: {e}")
+            return None
+
+    @staticmethod
+    def is_file_upload_reusable(file_upload: dict):
+        """
+        已经上传完成并且没有过期的文件可以再次添加到其他块中。
+        已经添加过的文件 expiry_time 为空，不会过期。
+        """
+        if not file_upload or file_upload.get("status") != "uploaded":
+            return False
+        expiry_time = file_upload.get("expiry_time")
+        if expiry_time is None:
+            return True
+        expiry_time = datetime.fromisoformat(expiry_time.replace("Z", "+00:00"))
+        # 留出一些时间用于创建块
+        return expiry_time - datetime.now(timezone.utc) > timedelta(minutes=5)
+
     def _create_file_upload_object(self, filename: str, content_type: str, mode: str, number_of_parts: int = None):
         """
         在 Notion 中创建文件上传对象。
@@ -85,7 +132,7 @@ class NotionFileUploader:
         try:
             # 对于这个请求，我们需要确保 Content-Type 是 application/json
             temp_headers = self.headers.copy()
-            response = requests.post(create_upload_url, headers=temp_headers, json=payload)
+            response = self.session.post(create_upload_url, headers=temp_headers, json=payload)
             response.raise_for_status()
             file_upload_data = response.json()
             print(f"已创建文件上传对象，ID: {file_upload_data['id']}")
@@ -114,7 +161,7 @@ class NotionFileUploader:
                 del send_headers["Content-Type"] # 移除可能冲突的 Content-Type
 
                 files = {"file": (file_name, f, content_type)}
-                send_response = requests.post(send_url, headers=send_headers, files=files)
+                send_response = self.session.post(send_url, headers=send_headers, files=files)
                 send_response.raise_for_status()
             print(f"文件内容发送成功，文件 ID: {file_upload_id}")
             return {"id": file_upload_id, "name": file_name, "content_type": content_type} # 返回上传成功的ID
@@ -124,13 +171,39 @@ class NotionFileUploader:
                 print(f"响应内容: {send_response.content.decode()}")
             return {"error": str(e)}
 
+    def _send_part(self, send_url: str, file_name: str, content_type: str, part, part_number: int):
+        """
+        发送一个分块，网络错误或者服务端错误时只重试这个分块。
+        """
+        send_headers = self.headers.copy()
+        del send_headers["Content-Type"]
+        files = {
+            "file": (file_name, part, content_type),
+            "part_number": (None, str(part_number)),
+        }
+        for attempt in range(self.MAX_PART_RETRIES):
+            try:
+                send_response = self.session.post(send_url, headers=send_headers, files=files)
+                send_response.raise_for_status()
+                return
+            except requests.exceptions.RequestException as e:
+                response = getattr(e, "response", None)
+                # 参数错误等重试也不会成功
+                if response is not None and response.status_code < 500 and response.status_code not in (409, 429):
+                    print(f"发送响应内容: {response.content.decode()}")
+                    raise
+                if attempt == self.MAX_PART_RETRIES - 1:
+                    raise
+                print(f"第 {part_number} 部分发送失败，重试: {e}")
+                time.sleep(2 ** attempt)
+
     def _multi_part_upload_content(self, file_path: str, file_name: str, content_type: str):
         """
         负责上传文件内容（多部分），返回 file_upload 对象的 ID。
+        分块通过 mmap 直接从文件中读取，多个分块并行发送。
         """
-        CHUNK_SIZE = 1024 * 1024 * 5  # 5 MB 分块大小
         file_size = os.path.getsize(file_path)
-        num_parts = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+        num_parts = (file_size + self.CHUNK_SIZE - 1) // self.CHUNK_SIZE
 
         file_upload_data = self._create_file_upload_object(file_name, content_type, "multi_part", num_parts)
         if "error" in file_upload_data:
@@ -139,33 +212,24 @@ class NotionFileUploader:
         file_upload_id = file_upload_data["id"]
         send_url = f"{self.base_url}/file_uploads/{file_upload_id}/send"
 
+        def send(i):
+            with memoryview(m) as view, view[i * self.CHUNK_SIZE:(i + 1) * self.CHUNK_SIZE] as part:
+                self._send_part(send_url, file_name, content_type, part, i + 1)
+            print(f"已发送第 {i+1}/{num_parts} 部分，文件 ID: {file_upload_id}")
+
         try:
-            with open(file_path, "rb") as f:
-                for i in range(num_parts):
-                    f.seek(i * CHUNK_SIZE)
-                    chunk = f.read(CHUNK_SIZE)
-                    
-                    send_headers = self.headers.copy()
-                    del send_headers["Content-Type"]
-
-                    files = {
-                        "file": (file_name, chunk, content_type),
-                        "part_number": (None, str(i + 1)),
-                    }
-                    
-                    send_response = requests.post(send_url, headers=send_headers, files=files)
-                    send_response.raise_for_status()
-                    print(f"已发送第 {i+1}/{num_parts} 部分，文件 ID: {file_upload_id}")
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                with ThreadPoolExecutor(max_workers=min(self.upload_workers, num_parts)) as executor:
+                    # 任意一个分块最终失败时抛出异常
+                    list(executor.map(send, range(num_parts)))
 
             complete_url = f"{self.base_url}/file_uploads/{file_upload_id}/complete"
-            complete_response = requests.post(complete_url, headers=self.headers, json={})
+            complete_response = self.session.post(complete_url, headers=self.headers, json={})
             complete_response.raise_for_status()
             print(f"已完成多部分上传，文件 ID: {file_upload_id}")
             return {"id": file_upload_id, "name": file_name, "content_type": content_type} # 返回上传成功的ID
         except requests.exceptions.RequestException as e:
             print(f"多部分上传内容时出错: {e}")
-            if 'send_response' in locals() and send_response is not None:
-                print(f"发送响应内容: {send_response.content.decode()}")
             if 'complete_response' in locals() and complete_response is not None:
                 print(f"完成响应内容: {complete_response.content.decode()}")
             return {"error": str(e)}
@@ -223,7 +287,7 @@ class NotionFileUploader:
             # 确保 Content-Type 是 application/json
             headers_for_block_creation = self.headers.copy() 
             # 统一使用 POST 请求到 .../{parent_id}/children 端点
-            response = requests.post(create_block_url, headers=headers_for_block_creation, json=block_payload)
+            response = self.session.post(create_block_url, headers=headers_for_block_creation, json=block_payload)
             
             response.raise_for_status()
             print(f"文件 '{file_name}' 已成功附加到 {parent_type}: {parent_id}")
@@ -291,7 +355,7 @@ class NotionFileUploader:
         
         try:
             # 确保 Content-Type 是 application/json
-            response = requests.patch(update_page_url, headers=self.headers, json={"properties": properties_payload})
+            response = self.session.patch(update_page_url, headers=self.headers, json={"properties": properties_payload})
             response.raise_for_status()
             print(f"数据库页面 '{page_id}' 的属性 '{property_name}' 已成功更新。")
             return response.json()
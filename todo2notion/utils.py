@@ -2,15 +2,11 @@ import calendar
 from datetime import datetime
 from datetime import timedelta
 import hashlib
+import json
 import os
 import re
-import requests
-import emoji
 
-
-import os, re, glob, base64, json
-from notion_client import Client
-from os import environ
+# pendulum、emoji以及网络请求相关的模块只在用到时导入，导入本模块转换Markdown时不需要加载
 from todo2notion.config import (
     RICH_TEXT,
     URL,
@@ -24,7 +20,7 @@ from todo2notion.config import (
     MULTI_SELECT,
     TZ
 )
-import pendulum
+from todo2notion import dates
 
 MAX_LENGTH = (
     1024  # NOTION 2000个字符限制https://developers.notion.com/reference/request-limits
@@ -186,53 +182,105 @@ def get_first_and_last_day_of_week(date):
     return first_day_of_week, last_day_of_week
 
 
+def encode_title(value):
+    return {"title": [{"type": "text", "text": {"content": value[:MAX_LENGTH]}}]}
+
+
+def encode_rich_text(value):
+    return {"rich_text": [{"type": "text", "text": {"content": value[:MAX_LENGTH]}}]}
+
+
+def encode_number(value):
+    return {"number": value}
+
+
+def encode_status(value):
+    return {"status": {"name": value}}
+
+
+def encode_files(value):
+    return {"files": [{"type": "external", "name": "Cover", "external": {"url": value}}]}
+
+
+def encode_date(value):
+    return {
+        "date": {
+            "start": datetime.fromtimestamp(value, dates.get_timezone()).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            ),
+            "time_zone": TZ,
+        }
+    }
+
+
+def encode_url(value):
+    return {"url": value}
+
+
+def encode_select(value):
+    return {"select": {"name": value}}
+
+
+def encode_multi_select(value):
+    return {"multi_select": [{"name": name} for name in value]}
+
+
+def encode_relation(value):
+    return {"relation": [{"id": id} for id in value]}
+
+
+def encode_people(value):
+    return {"people": [{"id": item.get("id"), "object": item.get("object")} for item in value]}
+
+
+PROPERTY_ENCODERS = {
+    TITLE: encode_title,
+    RICH_TEXT: encode_rich_text,
+    NUMBER: encode_number,
+    STATUS: encode_status,
+    FILES: encode_files,
+    DATE: encode_date,
+    URL: encode_url,
+    SELECT: encode_select,
+    MULTI_SELECT: encode_multi_select,
+    RELATION: encode_relation,
+    "people": encode_people,
+}
+
+
+def compile_property_encoder(schema):
+    """
+    根据database的property和类型的映射关系生成一个转换函数，
+    把{property名称: 值}转换成写入Notion需要的格式。
+    每个property对应的转换函数只在这里查找一次，不支持的类型直接忽略。
+    """
+    table = [
+        (key, PROPERTY_ENCODERS[type])
+        for key, type in schema.items()
+        if type in PROPERTY_ENCODERS
+    ]
+
+    def encode(values):
+        properties = {}
+        for key, encode_value in table:
+            value = values.get(key)
+            if value is not None:
+                properties[key] = encode_value(value)
+        return properties
+
+    return encode
+
+
+# 按照schema缓存转换函数，schema相同的调用不再重新生成
+_property_encoders = {}
+
+
 def get_properties(dict1, dict2):
-    properties = {}
-    for key, value in dict1.items():
-        type = dict2.get(key)
-        if value == None:
-            continue
-        property = None
-        if type == TITLE:
-            property = {
-                "title": [
-                    {"type": "text", "text": {"content": value[:MAX_LENGTH]}}
-                ]
-            }
-        elif type == RICH_TEXT:
-            property = {
-                "rich_text": [
-                    {"type": "text", "text": {"content": value[:MAX_LENGTH]}}
-                ]
-            }
-        elif type == NUMBER:
-            property = {"number": value}
-        elif type == STATUS:
-            property = {"status": {"name": value}}
-        elif type == FILES:
-            property = {"files": [{"type": "external", "name": "Cover", "external": {"url": value}}]}
-        elif type == DATE:
-            property = {
-                "date": {
-                    "start": pendulum.from_timestamp(
-                        value, tz="Asia/Shanghai"
-                    ).to_datetime_string(),
-                    "time_zone": "Asia/Shanghai",
-                }
-            }
-        elif type==URL:
-            property = {"url": value}        
-        elif type==SELECT:
-            property = {"select": {"name": value}}        
-        elif type==MULTI_SELECT:
-            property = {"multi_select": [{"name": name} for name in value]}
-        elif type == RELATION:
-            property = {"relation": [{"id": id} for id in value]}
-        elif type =="people":
-            property = {"people": [{"id": item.get("id"),"object":item.get("object")} for item in value]}
-        if property:
-            properties[key] = property
-    return properties
+    key = tuple(dict2.items())
+    encoder = _property_encoders.get(key)
+    if encoder is None:
+        encoder = _property_encoders[key] = compile_property_encoder(dict2)
+    return encoder(dict1)
 
 
 def get_property_value(property):
@@ -260,6 +308,54 @@ def get_property_value(property):
         return content
 
 
+def normalize_property(property):
+    """把写入格式或者读取格式的Property转换成可以比较的值"""
+    if property is None:
+        return None
+    type = property.get("type")
+    if type is None:
+        type = next(iter(property))
+    content = property.get(type)
+    if content is None:
+        return None
+    if type == TITLE or type == RICH_TEXT:
+        return "".join(
+            x.get("plain_text") or x.get("text", {}).get("content", "") for x in content
+        )
+    elif type == STATUS or type == SELECT:
+        return content.get("name")
+    elif type == MULTI_SELECT:
+        return sorted(x.get("name") for x in content)
+    elif type == RELATION or type == "people":
+        return sorted(x.get("id").replace("-", "") for x in content)
+    elif type == FILES:
+        return [x.get("external", {}).get("url") for x in content]
+    elif type == DATE:
+        import pendulum
+
+        tz = content.get("time_zone") or "UTC"
+        return [
+            pendulum.parse(x, tz=tz).int_timestamp if x else None
+            for x in (content.get("start"), content.get("end"))
+        ]
+    else:
+        return content
+
+
+def is_property_equal(new_property, old_property):
+    """判断新的Property和Notion中已有的Property是否相同"""
+    return normalize_property(new_property) == normalize_property(old_property)
+
+
+def get_empty_property(type):
+    """获取用于清空某个Property的值"""
+    if type in (DATE, NUMBER, SELECT, URL):
+        return {type: None}
+    if type in (RICH_TEXT, RELATION, MULTI_SELECT, FILES, "people"):
+        return {type: []}
+    return None
+
+
 def calculate_book_str_id(book_id):
     md5 = hashlib.md5()
     md5.update(book_id.encode("utf-8"))
@@ -304,6 +400,8 @@ def get_weread_url(book_id):
 def str_to_timestamp(date):
     if date == None:
         return 0
+    import pendulum
+
     dt = pendulum.parse(date)
     # 获取时间戳
     return int(dt.timestamp())
@@ -325,6 +423,39 @@ def url_to_md5(url):
 
     return hex_digest
 
+def update_file_hash(hash, file_path, chunk_size=1024 * 1024):
+    """分块读取文件更新hash，不会一次读入整个文件"""
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hash.update(chunk)
+    return hash
+
+
+def get_file_hash(file_path):
+    """计算文件内容的sha256"""
+    return update_file_hash(hashlib.sha256(), file_path).hexdigest()
+
+
+def get_range_offset(file_path, status_code, headers):
+    """
+    断点续传时判断服务器是否从file_path已有的位置继续返回，返回写入的起始位置。
+    服务器忽略Range时从头开始写入，返回的位置和请求的不一致时返回None。
+    """
+    if status_code == 200:
+        return 0
+    offset = os.path.getsize(file_path)
+    content_range = headers.get("Content-Range") or ""
+    if status_code == 206 and content_range.startswith(f"bytes {offset}-"):
+        return offset
+    return None
+
+
+def get_fingerprint(*values):
+    """计算内容的指纹，用于判断内容是否发生变化"""
+    content = json.dumps(values, ensure_ascii=False, sort_keys=True)
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
 def download_image(url, save_dir="cover"):
     # 确保目录存在，如果不存在则创建
     if not os.path.exists(save_dir):
@@ -338,7 +469,9 @@ def download_image(url, save_dir="cover"):
         print(f"File {file_name} already exists. Skipping download.")
         return save_path
 
-    response = requests.get(url, stream=True)
+    from todo2notion import transport
+
+    response = transport.get_session().get(url, stream=True)
     if response.status_code == 200:
         with open(save_path, "wb") as file:
             for chunk in response.iter_content(chunk_size=128):
@@ -349,10 +482,11 @@ def download_image(url, save_dir="cover"):
     return save_path
 
 def parse_date(date_str):
-        # get_task()
-    return pendulum.parse(date_str).int_timestamp
+    return dates.parse(date_str).timestamp
 
 def split_emoji_from_string(s):
+    import emoji
+
     # 检查第一个字符是否是emoji
     l = list(filter(lambda x: x.get("match_start")==0,emoji.emoji_list(s)))
     if len(l)>0:
@@ -363,191 +497,138 @@ def split_emoji_from_string(s):
         return '✅', s
 
 
-def replace_part(parts, pattern, replace_function):
-    # Process italic matches
-    new_text_parts = []
-    for part in parts:
-        if isinstance(part, str):
-            matches = list(re.finditer(pattern, part))
-            prev_end = 0
-            for match in matches:
-                if prev_end != match.start():
-                    new_text_parts.append(part[prev_end:match.start()])
-                new_text_parts.append(replace_function(match))
-                prev_end = match.end()
-            new_text_parts.append(part[prev_end:])
-        else:
-            new_text_parts.append(part)
-    return new_text_parts
+# 行内格式分两次扫描：先找出代码、链接和公式，其中的内容原样保留，
+# 剩下的文本再处理粗斜体、粗体、斜体和删除线，避免变量名或者链接中的"_"被当作斜体。
+# 第一次扫描找到的部分在文本中替换成占位符，粗体等格式可以包含它们，并把格式应用到它们上面
+PROTECTED_PATTERN = re.compile(
+    "|".join(
+        [
+            r"`(?P<code>.+?)`",
+            r"\[(?P<link_text>.+?)\]\((?P<link_url>.+?)\)",
+            r"\$(?P<katex>.+?)\$",
+        ]
+    )
+)
+EMPHASIS_PATTERN = re.compile(
+    "|".join(
+        [
+            r"__\*(?P<bold_italic_1>.+?)\*__|\*\*_(?P<bold_italic_2>.+?)_\*\*",
+            r"\*\*(?P<bold_1>.+?)\*\*|__(?P<bold_2>.+?)__",
+            r"\*(?P<italic_1>.+?)\*|_(?P<italic_2>.+?)_",
+            r"\~(?P<strikethrough>.+?)\~",
+        ]
+    )
+)
+PLACEHOLDER = "\x00"
+DEFAULT_ANNOTATIONS = {
+    "bold": False,
+    "italic": False,
+    "strikethrough": False,
+    "underline": False,
+    "code": False,
+    "color": "default",
+}
+
+
+def get_text_object(content, url=None, bold=False, italic=False, strikethrough=False, code=False):
+    return {
+        "type": "text",
+        "text": {
+            "content": content,
+            "link": {"url": url} if url else None
+        },
+        "annotations": {
+            "bold": bold,
+            "italic": italic,
+            "strikethrough": strikethrough,
+            "underline": False,
+            "code": code,
+            "color": "default"
+        },
+        "plain_text": content,
+        "href": url
+    }
+
+
+def convert_inline_match(match):
+    """把代码、链接或者公式的匹配转换成Notion的rich text"""
+    group = match.lastgroup
+    value = match.group(group)
+    if group == "code":
+        return get_text_object(value, code=True)
+    if group == "link_url":
+        return get_text_object(match.group("link_text"), url=value)
+    return {"type": "equation", "equation": {"expression": value}}
+
+
+def get_emphasis_annotations(group):
+    if group.startswith("bold_italic"):
+        return {"bold": True, "italic": True}
+    if group.startswith("bold"):
+        return {"bold": True}
+    if group.startswith("italic"):
+        return {"italic": True}
+    return {"strikethrough": True}
+
+
+def get_plain_text(text):
+    return {"type": "text", "text": {"content": text}}
+
+
+def convert_text(text, tokens, annotations=None):
+    """文本中的占位符按照顺序换成tokens中的rich text，有格式时同时应用到两者上"""
+    if PLACEHOLDER not in text:
+        return [get_text_object(text, **annotations) if annotations else get_plain_text(text)]
+    result = []
+    for index, part in enumerate(text.split(PLACEHOLDER)):
+        if index:
+            token = next(tokens)
+            if annotations:
+                # 公式没有annotations，使用默认值
+                token["annotations"] = {
+                    **token.get("annotations", DEFAULT_ANNOTATIONS),
+                    **annotations,
+                }
+            result.append(token)
+        if part:
+            result.append(
+                get_text_object(part, **annotations) if annotations else get_plain_text(part)
+            )
+    return result
+
 
 def process_inline_formatting(text):
     """
     Process inline formatting in Markdown text and convert it to Notion rich text formatting.
 
+    代码、链接和公式先匹配，其中的内容不再处理其他格式；其余文本再按照
+    粗斜体、粗体、斜体、删除线的优先级匹配，包在粗体等格式中的代码和链接同时带有这些格式。
+    两个正则都只编译一次。
+
     :param text: The Markdown text to be processed.
     :type text: str
     :return: A list of Notion rich text objects representing the processed text.
     :rtype: list
     """
+    protected = []
 
-    # Regular expressions for bold and italic markdown
-    code_pattern = r'`(.+?)`'
-    bold_pattern = r'(\*\*(.+?)\*\*)|(__(.+?)__)'
-    overline_pattern = r'\~(.+?)\~'
-    inline_katex_pattern = r'\$(.+?)\$'
-    italic_pattern = r'(\*(.+?)\*)|(_(.+?)_)'
-    link_pattern = r'\[(.+?)\]\((.+?)\)'
-    bold_italic_pattern = r'(__\*(.+?)\*__)|(\*\*_(.+?)_\*\*)'
-
-    def replace_katex(match):
-        return {
-            "type": "equation",
-            "equation": {
-                "expression": match.group(1)
-            }
-        }
-
-    def replace_bolditalic(match):
-        content = match.group(2) or match.group(4)
-        return {
-            "type": "text",
-            "text": {
-                "content": content,
-                "link": None
-            },
-            "annotations": {
-                "bold": True,
-                "italic": True,
-                "strikethrough": False,
-                "underline": False,
-                "code": False,
-                "color": "default"
-            },
-            "plain_text": content,
-            "href": None
-        }
-
-    # Replace markdown with Notion rich text formatting
-    def replace_code(match):
-        return {
-            "type": "text",
-            "text": {
-                "content": match.group(1),
-                "link": None
-            },
-            "annotations": {
-                "bold": False,
-                "italic": False,
-                "strikethrough": False,
-                "underline": False,
-                "code": True,
-                "color": "default"
-            },
-            "plain_text": match.group(1),
-            "href": None
-        }
-
-    # Replace markdown with Notion rich text formatting
-    def replace_overline(match):
-        return {
-            "type": "text",
-            "text": {
-                "content": match.group(1),
-                "link": None
-            },
-            "annotations": {
-                "bold": False,
-                "italic": False,
-                "strikethrough": True,
-                "underline": False,
-                "code": False,
-                "color": "default"
-            },
-            "plain_text": match.group(1),
-            "href": None
-        }
-    # Replace markdown with Notion rich text formatting
-    def replace_bold(match):
-        return {
-            "type": "text",
-            "text": {
-                "content": match.group(2) or match.group(4),
-                "link": None
-            },
-            "annotations": {
-                "bold": True,
-                "italic": False,
-                "strikethrough": False,
-                "underline": False,
-                "code": False,
-                "color": "default"
-            },
-            "plain_text": match.group(2) or match.group(4),
-            "href": None
-        }
+    def replace_protected(match):
+        protected.append(convert_inline_match(match))
+        return PLACEHOLDER
 
-    def replace_italic(match):
-        return {
-            "type": "text",
-            "text": {
-                "content": match.group(2) or match.group(4),
-                "link": None
-            },
-            "annotations": {
-                "bold": False,
-                "italic": True,
-                "strikethrough": False,
-                "underline": False,
-                "code": False,
-                "color": "default"
-            },
-            "plain_text": match.group(2) or match.group(4),
-            "href": None
-        }
-
-    def replace_link(match):
-        return {
-            "type": "text",
-            "text": {
-                "content": match.group(1),
-                "link": {
-                    "url": match.group(2)
-                }
-            },
-            "annotations": {
-                "bold": False,
-                "italic": False,
-                "strikethrough": False,
-                "underline": False,
-                "code": False,
-                "color": "default"
-            },
-            "plain_text": match.group(1),
-            "href": match.group(2)
-        }
-
-    # Apply the replacements for bold and italic formatting
-    text_parts = []
-
-    # Process bold italic matches
-    matches = list(re.finditer(bold_italic_pattern, text))
+    text = PROTECTED_PATTERN.sub(replace_protected, text.replace(PLACEHOLDER, ""))
+    tokens = iter(protected)
+    result = []
     prev_end = 0
-    for match in matches:
+    for match in EMPHASIS_PATTERN.finditer(text):
         if prev_end != match.start():
-            text_parts.append(text[prev_end:match.start()])
-        text_parts.append(replace_bolditalic(match))
+            result.extend(convert_text(text[prev_end:match.start()], tokens))
+        annotations = get_emphasis_annotations(match.lastgroup)
+        result.extend(convert_text(match.group(match.lastgroup), tokens, annotations))
         prev_end = match.end()
-    text_parts.append(text[prev_end:])
-
-    text_parts = replace_part(text_parts, bold_pattern, replace_bold)
-    text_parts = replace_part(text_parts, italic_pattern, replace_italic)
-    text_parts = replace_part(text_parts, inline_katex_pattern, replace_katex)
-    text_parts = replace_part(text_parts, overline_pattern, replace_overline)
-    text_parts = replace_part(text_parts, code_pattern, replace_code)
-    text_parts = replace_part(text_parts, link_pattern, replace_link)
-
-    # Remove empty strings from the list and return the processed text parts
-    return [({"type": "text", "text": {"content": part}} if type(part) == str else part) for part in text_parts if part != '']
+    if prev_end < len(text):
+        result.extend(convert_text(text[prev_end:], tokens))
+    return result
 
 # katex
 def convert_markdown_table_to_latex(text):
@@ -580,290 +661,6 @@ def convert_markdown_table_to_latex(text):
 
     return add_table
 
-def parse_markdown_to_notion_blocks(markdown):
-    """
-    Parse Markdown text and convert it into a list of Notion blocks.
-
-    :param markdown: The Markdown text to be parsed.
-    :type markdown: str
-    :return: A list of Notion blocks representing the parsed Markdown content.
-    :rtype: list
-    """
-
-    # Detect code blocks enclosed within triple backticks
-    code_block_pattern = re.compile(r'```(\w+?)\n(.+?)```', re.DOTALL)
-    # katex
-    latex_block_pattern = re.compile(r'\$\$(.+?)\$\$', re.DOTALL)
-    numbered_list_pattern_nested = r'^( *)(\d+)\. '
-    unordered_list_pattern_nested = r'^( *)(\-) '
-    heading_pattern = r'^(#+) '
-
-    #indented_code_pattern = re.compile(r'^ {4}(.+)$', re.MULTILINE)
-    triple_backtick_code_pattern = re.compile(r'^```(.+?)```', re.MULTILINE | re.DOTALL)
-    blockquote_pattern = r'^> (.+)$'
-    horizontal_line_pattern = r'^-{3,}$'
-    image_pattern = r'!\[(.*?)\]\((.*?)\)'
-
-    code_blocks = {}
-    def replace_code_blocks(match):
-        index = len(code_blocks)
-        language, content = match.group(1), match.group(2)
-        code_blocks[index] = (language or 'plain text').strip(), content.strip()
-        return f'CODE_BLOCK_{index}'
-
-    # Replace code blocks with placeholders
-    markdown = code_block_pattern.sub(replace_code_blocks, markdown)
-
-    # katex
-    latex_blocks = {}
-    def replace_latex_blocks(match):
-        index = len(latex_blocks)
-        latex_blocks[index] = (match.group(1)+"").strip()
-        return f'LATEX_BLOCK_{index}'
-
-    # Replace code blocks with placeholders
-    markdown = latex_block_pattern.sub(replace_latex_blocks, markdown)
-
-    lines = markdown.split("\n")
-    blocks = []
-
-    # Initialize variables to keep track of the current table
-    current_table = []
-    in_table = False
-
-    current_indent = 0
-    stack = [blocks]
-
-    indented_code_accumulator = []
-    for line in lines:
-
-        # Check if the line is a table row (e.g., "| Header 1 | Header 2 |" or "| Content 1 | Content 2 |")
-        is_table_row = re.match(r'\|\s*[^-|]+\s*\|', line)
-        # Check if the line is a table delimiter (e.g., "|---|---|")
-        is_table_delimiter = re.match(r'\|\s*[-]+\s*\|\s*[-]+\s*\|', line)
-
-        # If we find table row or delimiter, add the line to the current table
-        if is_table_row or is_table_delimiter:
-            current_table.append(line)
-            in_table = True
-            continue
-        elif in_table and (not is_table_row and not is_table_delimiter):
-            # If we find a non-table line and we're in a table, end the current table
-            in_table = False
-            # Process the current table
-            table_str = "\n".join(current_table)
-            # katex
-            latex_table = convert_markdown_table_to_latex(table_str)
-            # Create Notion equation block with LaTeX table expression
-            equation_block = {
-                "type": "equation",
-                "equation": {
-                    "expression": latex_table
-                }
-            }
-            blocks.append(equation_block)
-            # Reset the current table
-            current_table = []
-            continue
-
-        list_match = re.match(numbered_list_pattern_nested, line)
-        if list_match:
-            indent = len(list_match.group(1))
-            line = line[len(list_match.group(0)):]
-
-            item = {
-                "object": "block",
-                "type": "numbered_list_item",
-                "numbered_list_item": {
-                    "rich_text": process_inline_formatting(line)
-                }
-            }
-
-            while indent < current_indent:
-                # If the indentation is less than the current level, go back one level in the stack
-                stack.pop()
-                current_indent -= 1
-
-            if indent == current_indent:
-                # Same level of indentation, add to the current level of the stack
-                stack[-1].append(item)
-            else: # indent > current_indent
-                # Nested item, add it as a child of the previous item
-                if 'children' not in stack[-1][-1]['numbered_list_item']:
-                    stack[-1][-1]['numbered_list_item']['children'] = []
-                stack[-1][-1]['numbered_list_item']['children'].append(item)
-                stack.append(stack[-1][-1]['numbered_list_item']['children']) # Add a new level to the stack
-                current_indent += 1
-
-            continue
-
-        list_match = re.match(unordered_list_pattern_nested, line)
-        if list_match:
-            indent = len(list_match.group(1))
-            line = line[len(list_match.group(0)):]
-
-            item = {
-                "object": "block",
-                "type": "bulleted_list_item",
-                "bulleted_list_item": {
-                    "rich_text": process_inline_formatting(line)
-                }
-            }
-
-            while indent < current_indent:
-                # If the indentation is less than the current level, go back one level in the stack
-                stack.pop()
-                current_indent -= 1
-
-            if indent == current_indent:
-                # Same level of indentation, add to the current level of the stack
-                stack[-1].append(item)
-            else: # indent > current_indent
-                # Nested item, add it as a child of the previous item
-                if 'children' not in stack[-1][-1]['bulleted_list_item']:
-                    stack[-1][-1]['bulleted_list_item']['children'] = []
-                stack[-1][-1]['bulleted_list_item']['children'].append(item)
-                stack.append(stack[-1][-1]['bulleted_list_item']['children']) # Add a new level to the stack
-                current_indent += 1
-
-            continue
-
-        if line.startswith('    '):  # Check if the line is indented
-            indented_code_accumulator.append(line[4:])  # Remove the leading spaces
-            continue
-        else:
-            if indented_code_accumulator:  # Check if there are accumulated lines
-                code_block = '\n'.join(indented_code_accumulator)
-                blocks.append({
-                    "object": "block",
-                    "type": "code",
-                    "code": {
-                        "language": "plain text",
-                        "rich_text": [{"type": "text", "text": {"content": code_block}}]
-                    }
-                })
-                # Clear the accumulator
-                indented_code_accumulator = []
-
-        # Check for headings and create appropriate heading blocks
-        heading_match = re.match(heading_pattern, line)
-        blockquote_match = re.match(blockquote_pattern, line)
-        image_match = re.search(image_pattern, line)
-
-        if heading_match:
-            heading_level = len(heading_match.group(1))
-            content = re.sub(heading_pattern, '', line)
-            if 1 <= heading_level <= 3:
-                block_type = f"heading_{heading_level}"
-                blocks.append({
-                    "object": "block",
-                    "type": block_type,
-                    block_type: {
-                        "rich_text": process_inline_formatting(content)
-                    }
-                })
-
-        # Check for horizontal line and create divider blocks
-        elif re.match(horizontal_line_pattern, line):
-            blocks.append({
-                "divider": {},
-                "type": "divider"
-            })
-
-        # Check for blockquote and create blockquote blocks
-        elif blockquote_match:
-            blocks.append({
-                "object": "block",
-                "type": "quote",
-                "quote": {
-                    "rich_text": process_inline_formatting(blockquote_match.group(1))
-                }
-            })
-
-        # Check for code blocks and create code blocks
-        elif line.startswith("CODE_BLOCK_"):
-            code_block_index = int(line[len("CODE_BLOCK_"):])
-            language, code_block = code_blocks[code_block_index]
-            blocks.append({
-                "object": "block",
-                "type": "code",
-                "code": {
-                    "language": language,
-                    "rich_text": [{"type": "text", "text": {"content": code_block}}]
-                }
-            })
-
-        # Check for katex blocks
-        elif line.startswith("LATEX_BLOCK_"):
-            latex_block_index = int(line[len("LATEX_BLOCK_"):])
-            latex_content = latex_blocks[latex_block_index]
-            blocks.append({
-                "type": "equation",
-                "equation": {
-                    "expression": latex_content
-                }
-            })
-
-        # Image blocks
-        elif image_match:
-            block = {
-              "object": "block",
-              "type": "image",
-              "image": {
-                "external":{
-                    "url": image_match.group(2),
-                }
-              }
-            }
-            caption = image_match.group(1)
-            if caption:
-                block["image"]["caption"] = [
-                  {
-                    "type": "text",
-                    "text": {
-                      "content": caption,
-                      "link": None
-                    }
-                  }
-                ]
-            blocks.append(block)
-
-        # Create paragraph blocks for other lines
-        elif line.strip():
-            blocks.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": process_inline_formatting(line)
-                }
-            })
-
-    # If there's an unfinished table at the end of the lines, process it
-    if in_table:
-        table_str = "\n".join(current_table)
-        latex_table = convert_markdown_table_to_latex(table_str)
-        equation_block = {
-            "type": "equation",
-            "equation": {
-                "expression": latex_table
-            }
-        }
-        blocks.append(equation_block)
-
-    # Add any remaining indented lines as a code block
-    if indented_code_accumulator:
-        code_block = '\n'.join(indented_code_accumulator)
-        blocks.append({
-            "object": "block",
-            "type": "code",
-            "code": {
-                "language": "plain text",
-                "rich_text": [{"type": "text", "text": {"content": code_block}}]
-            }
-        })
-
-    return blocks
-
 def parse_md(markdown_text):
     """
     Parse Markdown text and convert it into Notion blocks.
@@ -873,5 +670,6 @@ def parse_md(markdown_text):
     :return: A list of Notion blocks representing the parsed Markdown content.
     :rtype: list
     """
-    # Parse the transformed Markdown to create Notion blocks
-    return parse_markdown_to_notion_blocks(markdown_text.strip())
+    from todo2notion.notion_renderer import render_markdown
+
+    return render_markdown(markdown_text.strip())